@@ -1,4 +1,4 @@
-import sys
+import os, sys, asyncio, threading, multiprocessing
 from configparser import ConfigParser
 
 # import tkinter
@@ -9,9 +9,15 @@ import tkinter.messagebox as mbox
 from view import View
 from workspace import Workspace
 
-from dialog import AboutDialog, PrefDialog
+from dialog import AboutDialog, PrefDialog, RevisionDialog, SearchDialog, DiagnosticsDialog
 
 from lib.extendedTk import *
+from lib.scheduler import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from lib.session import Session, config_hash
+from lib.search import ProjectIndex, BLOCK_LINES
+from lib.aiotk import AsyncBridge
+from lib.diagnostics import Diagnostics
+from lib import instance
 
 #============================================================================
 # config
@@ -20,11 +26,17 @@ DEFAULT_CONFIG = {
     'view': {
         'width': '1200',
         'height': '800',
-        'state': 'normal'
+        'state': 'normal',
+        'single_instance': '1'
     },
     'workspace': {
         'font': '"Courier New" 10',
         'text_width': '128',
+        'dictionary': '',
+        'undo_memory': '16',
+        'keep_revisions': '1',
+        'autosave': '0',
+        'pattern_budget': '500',
         'last_file': ''
     },
     'colors': {
@@ -34,12 +46,23 @@ DEFAULT_CONFIG = {
         'fg_text':      '#000000',
         'bg_text':      '#f1f1f1',
         'scrollbar':    '#6f6f6f',
+        'line_added':   '#28a745',
+        'line_modified': '#dbab09',
     },
     'patterns': {
         'title': '#.*',
         'separator': '\*\*\*',
         'paragraph': '§.*'
     },
+    'layout': {
+        'font': '"Courier New" 12',
+        'page_width': '8.5',
+        'page_height': '11',
+        'margin': '1',
+        'line_spacing': '2'
+    },
+    # multi-line regions, none by default, see README.md
+    'regions': {},
     'tag.title': {
         'foreground': '#a968c2',
         'font': '"Courier New" 24 bold'
@@ -53,6 +76,10 @@ DEFAULT_CONFIG = {
         'justify': 'center',
         'spacing1': '12',
         'spacing3': '12'
+    },
+    'tag.misspelled': {
+        'underline': '1',
+        'underlinefg': '#d73a49'
     }
 }
 
@@ -65,6 +92,7 @@ FILEDIALOG_OPTIONS = {
     'defaultextension' : ".txt",
     'filetypes': [
         ("Text Documents", "*.txt"),
+        ("Compressed Text Documents", ("*.txt.gz", "*.txt.xz")),
         ("All Files", "*.*")
     ]
 }
@@ -79,6 +107,11 @@ class Capricorn():
         self.view = View()
         self.workspace = Workspace(self.view)
 
+        # file operations run as coroutines on the Tk main loop
+        self.bridge = AsyncBridge(self.view)
+        self._config_lock = threading.Lock()
+        self._autosave_job = None
+
         # parse config file
         config = ConfigParser()
         config.read_dict(DEFAULT_CONFIG)
@@ -92,36 +125,75 @@ class Capricorn():
             'workspace': dict(config['workspace']),
             'colors':    dict(config['colors']),
             'patterns':  dict(config['patterns']),
+            'regions':   dict(config['regions']),
+            'layout':    dict(config['layout']),
             'tags':      get_tags(config),
         })
 
         # bind events
         self.view.bind("<<text-changed>>", self.on_text_change)
         self.view.bind("<<insert-moved>>", self.on_insert_move)
+        self.view.bind("<<complete>>", self.on_complete)
+        self.view.bind("<<yview-changed>>", self.on_yview_change)
+        self.view.bind("<<file-reloaded>>", self.on_file_reload)
+        self.view.bind("<<pattern-disabled>>", self.on_pattern_disabled)
 
         self.view.bind('<<new>>',       self.new_file)
-        self.view.bind('<<open>>',      self.open)
-        self.view.bind('<<save>>',      self.save)
-        self.view.bind('<<save-as>>',   self.save_as)
+        self.view.bind('<<open>>',      lambda e: self.run_file_task(self.open_async()))
+        self.view.bind('<<save>>',      lambda e: self.run_file_task(self.save_async()))
+        self.view.bind('<<save-as>>',   lambda e: self.run_file_task(self.save_as_async()))
 
         self.view.bind('<<show-about>>', lambda e:
                        AboutDialog(e.widget))
         self.view.bind('<<show-pref>>', lambda e:
-                       PrefDialog(e.widget, self.config, self.apply_config))
+                       PrefDialog(e.widget, self.config, self.apply_config, self.workspace.patterns.stats()))
+
+        self.view.bind('<<show-revisions>>', lambda e:
+                       RevisionDialog(e.widget, self.workspace))
+        self.view.bind('<<show-search>>', self.show_search)
+        self.view.bind('<<index-updated>>', self.on_index_update)
+
+        self.view.bind('<<show-diagnostics>>', lambda e:
+                       DiagnosticsDialog(e.widget, self.diagnostics, self.save_diagnostics))
+        self.view.bind('<<dump-diagnostics>>', lambda e: self.save_diagnostics())
 
         self.view.bind('<<wnd-close>>', self.exit)
         self.view.protocol("WM_DELETE_WINDOW", self.exit)
 
+        # session is stored next to the config file
+        config_dir = os.path.dirname(os.path.abspath(config_path))
+        self.session = Session(os.path.join(config_dir, 'session.json'))
+        self.session.load()
+
+        # full text index of the folder of the open file
+        self.index = None
+        self.search_dialog = None
+
+        # memory figures for the diagnostics panel
+        self.diagnostics = Diagnostics(self.view.text)
+        self.workspace.register_diagnostics(self.diagnostics)
+        self.diagnostics.register('scheduler', self.view.scheduler.stats)
+        self.diagnostics.register('async', lambda: {
+            'tasks': len(asyncio.all_tasks(self.bridge.loop)),
+            'keys': list(self.bridge.tasks),
+        })
+        self.diagnostics.register('session', lambda: {'files': len(self.session.files)})
+
+        # later launches hand their file over to this instance
+        self.server = instance.InstanceServer(self.view, self.on_remote_open)
+        if self.config['view']['single_instance'] == '1':
+            self.server.start()
+
         # read file
         path = filename or self.config['workspace']['last_file']
-        if path:
-            self.workspace.read_file(path)
+        if path and self.workspace.read_file(path) and not self.restore_session():
+            self.analyze()
 
         self.update_title()
 
     def apply_config(self, config: dict) -> None:
         self.load_config(config)
-        self.save_config()
+        self.bridge.run(asyncio.to_thread(self.write_config, self.collect_config()))
 
     def load_config(self, config: dict) ->None:
         self.config |= config
@@ -129,8 +201,25 @@ class Capricorn():
         self.view.load_config(self.config['view'])
         self.view.load_theme(self.config['colors'], self.config['tags'])
         self.workspace.load_config(self.config['workspace'])
+        self.workspace.load_patterns(self.config['patterns'], self.config['regions'])
+        self.view.scheduler.schedule('highlighting', self.workspace.update_highlighting, PRIORITY_NORMAL)
+        self.workspace.load_layout(self.config['layout'], self.config['tags'])
+        self.view.scheduler.schedule('page-count', self.workspace.update_page_count, PRIORITY_LOW)
+
+        # autosave interval in seconds, 0 turns it off
+        if self._autosave_job:
+            self.view.after_cancel(self._autosave_job)
+            self._autosave_job = None
+
+        interval = int(self.config['workspace']['autosave'])
+        if interval > 0:
+            self._autosave_job = self.view.after(interval * 1000, self.autosave, interval)
 
     def save_config(self) -> None:
+        self.write_config(self.collect_config())
+
+    def collect_config(self) -> ConfigParser:
+        """ Returns the config to save, must run on the main thread """
         # update view config
         view_config = self.config['view']
 
@@ -146,40 +235,160 @@ class Capricorn():
         ws_config['last_file'] = self.workspace.path or ''
 
         # tags
-        for name, settings in self.config.pop('tags').items():
-            self.config[f'tag.{name}'] = settings
+        sections = {name: section for name, section in self.config.items() if name != 'tags'}
+        for name, settings in self.config['tags'].items():
+            sections[f'tag.{name}'] = settings
 
-        # write to config file
         config = ConfigParser()
-        config.read_dict(self.config)
+        config.read_dict(sections)
+        return config
 
-        with open(self.config_path, 'w', encoding="utf-8") as configfile:
+    def write_config(self, config: ConfigParser) -> None:
+        """ Write the config file, safe to call from any thread """
+        with self._config_lock, open(self.config_path, 'w', encoding="utf-8") as configfile:
             config.write(configfile)
 
+    def patterns_key(self) -> str:
+        return config_hash(self.config['patterns'], self.config['regions'])
+
+    def store_session(self) -> None:
+        """ Remember cursor, scroll position and analysis of the open file """
+        if not self.workspace.path:
+            return
+        self.session.update(self.workspace.path, self.workspace.get_state(self.patterns_key()))
+
+    def restore_session(self) -> bool:
+        state = self.session.get(self.workspace.path)
+        if state and self.workspace.restore_state(state, self.patterns_key()):
+            # nothing changed, the cached analysis is up to date
+            self.view.scheduler.cancel('highlighting')
+            self.view.scheduler.cancel('word-count')
+            return True
+        return False
+
+    def analyze(self) -> None:
+        """ Analyze a large file that was just opened on all cores """
+        if self.workspace.analyze(self.on_analyzed):
+            self.view.scheduler.cancel('highlighting')
+            self.view.scheduler.cancel('word-count')
+
+    def on_analyzed(self, applied: bool) -> None:
+        scheduler = self.view.scheduler
+        # lines after regions that span chunks are lexed again
+        scheduler.schedule('highlighting', self.workspace.update_highlighting, PRIORITY_NORMAL)
+        scheduler.schedule('page-count', self.workspace.update_page_count, PRIORITY_LOW)
+        if not applied:
+            scheduler.schedule('word-count', self.workspace.update_word_count, PRIORITY_LOW)
+
+    def save_session(self) -> None:
+        self.store_session()
+        try:
+            self.session.save()
+        except OSError as e:
+            self.view.write_error(f"Could not save session: {e}")
+
+    def on_remote_open(self, args: list) -> None:
+        # bring the window to the front
+        self.view.deiconify()
+        self.view.lift()
+        self.view.focus_force()
+
+        if args:
+            self.open(filename=args[0])
+
+    def get_index(self) -> ProjectIndex:
+        """ Returns the index of the folder of the open file and starts
+            bringing it up to date in the background when the folder changed """
+        if not self.workspace.path:
+            return None
+
+        folder = os.path.dirname(self.workspace.path)
+        if not self.index or self.index.folder != folder:
+            self.index = ProjectIndex(folder)
+            thread = threading.Thread(target=self.index.update, daemon=True)
+            thread.start()
+            self.view.after(100, self.wait_for_index, self.index, thread)
+        return self.index
+
+    def wait_for_index(self, index: ProjectIndex, thread: threading.Thread) -> None:
+        """ Report the end of an index update with <<index-updated>> """
+        if thread.is_alive():
+            self.view.after(100, self.wait_for_index, index, thread)
+        elif index is self.index:
+            self.view.event_generate('<<index-updated>>')
+
+    def show_search(self, event: tk.Event) -> None:
+        if self.search_dialog and self.search_dialog.winfo_exists():
+            self.search_dialog.lift()
+            self.search_dialog.entry_query.focus_set()
+            return
+        self.search_dialog = SearchDialog(event.widget, self.search_project, self.open_hit)
+
+    def on_index_update(self, _:tk.Event) -> None:
+        # the search ran against an incomplete index
+        dialog = self.search_dialog
+        if dialog and dialog.winfo_exists() and dialog.query.get():
+            dialog.search()
+
+    def search_project(self, query: str) -> list:
+        index = self.get_index()
+        return index.search(query) if index else []
+
+    def open_hit(self, path: str, line: int, query: str) -> None:
+        if path != self.workspace.path and not self.open(filename=path):
+            return
+        self.workspace.goto(line, query, BLOCK_LINES)
+
+    def save_diagnostics(self) -> None:
+        path = filedialog.asksaveasfilename(defaultextension=".json", initialfile="memory.json",
+                                            filetypes=[("JSON", "*.json"), ("All Files", "*.*")])
+        if not path:
+            return
+
+        try:
+            self.diagnostics.dump(path)
+        except OSError as e:
+            self.view.write_error(f"Failed to save {path}: {e}")
+            return
+        self.view.write_status(f"Saved memory report to {path}")
+
     def run(self) -> None:
         self.view.mainloop()
 
     def on_text_change(self, _:tk.Event) -> None:
-        self.workspace.update_word_count()
-
-        # tag all patterns
-        for tag, pattern in self.config['patterns'].items():
-            self.workspace.tag_pattern(pattern, tag)
+        scheduler = self.view.scheduler
+        scheduler.schedule('highlighting', self.workspace.update_highlighting, PRIORITY_NORMAL)
+        scheduler.schedule('word-count', self.workspace.update_word_count, PRIORITY_LOW)
+        scheduler.schedule('page-count', self.workspace.update_page_count, PRIORITY_LOW)
 
         if self.workspace.saved:
             self.workspace.saved = False
             self.update_title()
 
-    def on_insert_move(self, _:tk.Event) -> None:
-        self.workspace.update_insert_pos()
+    def on_insert_move(self, event:tk.Event) -> None:
+        self.view.scheduler.schedule('insert-pos', lambda:
+                                     self.workspace.update_insert_pos(event.widget), PRIORITY_HIGH)
+
+    def on_file_reload(self, _:tk.Event) -> None:
+        self.view.write_status(f"Reloaded {self.workspace.filename} after an external change")
+        self.update_title()
+
+    def on_pattern_disabled(self, _:tk.Event) -> None:
+        self.view.write_error(self.workspace.pattern_warning)
+
+    def on_yview_change(self, _:tk.Event) -> None:
+        self.workspace.update_spelling()
+
+    def on_complete(self, _:tk.Event) -> None:
+        self.view.show_completions(self.workspace.get_completions())
 
     def update_title(self) -> None:
         self.view.title(self.workspace.get_title())
 
-    def check_saved(self) -> bool:
-        """ Check if the file is saved and can be closed. 
-            Returns True if it can be closed, esle False  """
-        
+    def ask_save(self) -> bool:
+        """ Check if the file is saved and can be closed.
+            Returns True if it can be closed, False to cancel and None
+            if it has to be saved first """
         if self.workspace.saved:
             return True
 
@@ -189,14 +398,48 @@ class Capricorn():
         result = mbox.askyesnocancel(title=title, message=prompt, default=mbox.YES)
 
         if result is True:      # yes
-            return self.save()
-        elif result is False:   # no
+            return None
+        return result is False  # no or cancel
+
+    def check_saved(self) -> bool:
+        """ Check if the file is saved and can be closed. 
+            Returns True if it can be closed, esle False  """
+        result = self.ask_save()
+        return self.save() if result is None else result
+
+    async def check_saved_async(self) -> bool:
+        result = self.ask_save()
+        return await self.save_async() if result is None else result
+
+    def run_file_task(self, coro) -> None:
+        """ Run a file operation, only one at a time """
+        if self.file_busy():
+            coro.close()
+            return
+        self.bridge.run(coro, key='file')
+
+    def file_busy(self) -> bool:
+        """ Returns True and reports it if a file operation is running """
+        if self.bridge.running('file'):
+            self.view.write_error("Another file operation is still running")
             return True
+        return False
+
+    def report_progress(self, action: str, path: str):
+        """ Returns a progress callback writing to the status bar """
+        name = os.path.basename(path)
+        return lambda done, total: self.view.write_status(
+            f"{action} {name}... {100 * done // total if total else 100}%")
 
-        return False            # cancel
+    def autosave(self, interval: int) -> None:
+        """ Save in the background every interval seconds. A Tk timer, so
+            the event loop only runs while there is something to save """
+        self._autosave_job = self.view.after(interval * 1000, self.autosave, interval)
+        if self.workspace.path and not self.workspace.saved and not self.bridge.running('file'):
+            self.run_file_task(self.save_async())
 
     def new_file(self, _:tk.Event=None) -> bool:
-        if not self.check_saved():
+        if self.file_busy() or not self.check_saved():
             return False
 
         self.workspace.new_file()
@@ -204,15 +447,32 @@ class Capricorn():
         return True
 
     def open(self, _:tk.Event = None, filename:str = None) -> bool:
-        if not self.check_saved():
+        if self.file_busy() or not self.check_saved():
+            return False
+
+        path = filename or filedialog.askopenfilename(**FILEDIALOG_OPTIONS)
+        if not path:
+            return False
+
+        self.store_session()
+        return self.on_opened(path, self.workspace.read_file(path))
+
+    async def open_async(self, filename:str = None) -> bool:
+        if not await self.check_saved_async():
             return False
 
         path = filename or filedialog.askopenfilename(**FILEDIALOG_OPTIONS)
         if not path:
             return False
 
-        result = self.workspace.read_file(path)
+        self.store_session()
+        result = await self.workspace.read_file_async(path, self.report_progress("Opening", path))
+        return self.on_opened(path, result)
+
+    def on_opened(self, path: str, result: bool) -> bool:
         if result:
+            if not self.restore_session():
+                self.analyze()
             self.view.write_status(f"Opened {path}")
         else:
             self.view.write_error(f"Failed to open {path}")
@@ -223,14 +483,34 @@ class Capricorn():
     def save(self, _:tk.Event = None) -> bool:
         return self.save_as(filename=self.workspace.path)
 
+    async def save_async(self) -> bool:
+        return await self.save_as_async(filename=self.workspace.path)
+
     def save_as(self, event:tk.Event = None, filename:str = None) -> bool:
         path = filename or filedialog.asksaveasfilename(**FILEDIALOG_OPTIONS)
         if not path:
             return False
 
-        result = self.workspace.write_file(path)
+        return self.on_saved(path, self.workspace.write_file(path))
+
+    async def save_as_async(self, filename:str = None) -> bool:
+        path = filename or filedialog.asksaveasfilename(**FILEDIALOG_OPTIONS)
+        if not path:
+            return False
+
+        result = await self.workspace.write_file_async(path, self.report_progress("Saving", path))
+        return self.on_saved(path, result)
+
+    def on_saved(self, path: str, result: bool) -> bool:
         if result:
-            self.view.write_status(f"Successfully saved {path}")
+            # keep an index that is in use up to date, never start one
+            index = self.index
+            if index and index.folder == os.path.dirname(os.path.abspath(path)):
+                threading.Thread(target=index.refresh, args=(path,), daemon=True).start()
+            if self.workspace.revision_error:
+                self.view.write_error(f"Saved {path}, but {self.workspace.revision_error}")
+            else:
+                self.view.write_status(f"Successfully saved {path}")
         else:
             self.view.write_error(f"Failed to save {path}")
 
@@ -238,11 +518,20 @@ class Capricorn():
         return result
 
     def exit(self, *args) -> None:
-        # save config
+        # let a running save finish first
+        if self.bridge.running('file'):
+            self.view.write_error("Wait for the current file operation to finish")
+            return
+
+        # save config and session
         self.save_config()
+        self.save_session()
 
         # aks to save and close
         if self.check_saved():
+            self.bridge.close()
+            self.server.close()
+            self.workspace.close()
             self.view.destroy()
 
 #TODO: color picker entry
@@ -250,8 +539,15 @@ class Capricorn():
 #TODO: latex exporter
 #TODO: config 'last_file' only if saved
 if __name__ == '__main__':
+    # worker processes of a frozen build start here, let them run
+    multiprocessing.freeze_support()
+
     filename = sys.argv[1] if len(sys.argv) > 1 else None
 
+    # open the file in the running instance if there is one
+    if instance.forward(sys.argv[1:2]):
+        sys.exit(0)
+
     app = Capricorn("config.ini", filename)
     app.run()
 
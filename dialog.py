@@ -1,3 +1,5 @@
+import os, json, time, tracemalloc
+
 import tkinter as tk
 import tkinter.font as tkfont
 from tkinter import ttk
@@ -85,11 +87,12 @@ class AboutDialog(tk.Toplevel):
 # preferences
 #============================================================================
 class PrefDialog(tk.Toplevel):
-    def __init__(self, parent, config, apply, title=None):
+    def __init__(self, parent, config, apply, patterns=None, title=None):
         """Create dialog, do not return until tk widget destroyed."""
         super().__init__(parent)
 
         self.apply_cb = apply
+        self.patterns = patterns or []
 
         self.title(title or 'Preferences')
         x = parent.winfo_rootx() + 20
@@ -111,7 +114,8 @@ class PrefDialog(tk.Toplevel):
 
         self.frames = [
             WorkspaceFrame(frame_content, "Workspace", config['workspace']),
-            ColorFrame(frame_content, "Colors", config['colors'])
+            ColorFrame(frame_content, "Colors", config['colors']),
+            PatternFrame(frame_content, "Patterns", self.patterns)
         ]
 
         for frame in self.frames:
@@ -187,10 +191,37 @@ class ColorFrame(ttk.LabelFrame):
         return { 'colors': {k: f"#{v.get()}" for k,v in self.colors.items()} }
 
 
+class PatternFrame(ttk.LabelFrame):
+    """ Shows the time spent in every highlighting pattern """
+    def __init__(self, master, text, patterns):
+        super().__init__(master, text=text)
+
+        self.patterns = patterns
+        self.create_widgets()
+
+    def create_widgets(self):
+        self.columnconfigure(0, weight=1)
+
+        headers = ("Tag", "Total", "Per Line", "Status")
+        for column, header in enumerate(headers):
+            label = ttk.Label(self, text=header)
+            label.grid(row=0, column=column, sticky=tk.W, padx=5, pady=2)
+
+        for row, (tag, total, per_line, status) in enumerate(self.patterns, 1):
+            values = (tag, f"{total:.1f} ms", f"{per_line:.1f} \u00b5s", status)
+            for column, value in enumerate(values):
+                label = ttk.Label(self, text=value)
+                label.grid(row=row, column=column, sticky=tk.W, padx=5, pady=2)
+
+    def get_config(self):
+        return {}
+
+
 class WorkspaceFrame(ttk.LabelFrame):
     def __init__(self, master, text, config):
         super().__init__(master, text=text)
 
+        self.settings = config
         self.text_width = tk.IntVar(self, config['text_width'])
 
         self.font_family = tk.StringVar(self, 'Courier New')
@@ -234,4 +265,259 @@ class WorkspaceFrame(ttk.LabelFrame):
             'text_width': self.text_width.get()
         }
 
-        return { 'workspace': config }
\ No newline at end of file
+        # keep settings that are not shown in the dialog
+        return { 'workspace': self.settings | config }
+
+#============================================================================
+# revisions
+#============================================================================
+class RevisionDialog(tk.Toplevel):
+    def __init__(self, parent, workspace, title=None):
+        """Create dialog, do not return until tk widget destroyed."""
+        super().__init__(parent)
+
+        self.workspace = workspace
+        self.revisions = list(reversed(workspace.get_revisions()))
+
+        self.title(title or f'Revisions of {workspace.filename}')
+        x = parent.winfo_rootx() + 20
+        y = parent.winfo_rooty() + 30
+        self.geometry(f'+{x}+{y}')
+
+        self.create_widgets()
+        self.transient(parent)
+
+        self.bind('<Escape>', self.close)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.grab_set()
+        self.wm_deiconify()
+        self.wait_window()
+
+    def create_widgets(self):
+        frame_content = ttk.Frame(self)
+        frame_content.rowconfigure(0, weight=1)
+        frame_content.columnconfigure(1, weight=1)
+
+        # revision list, newest first
+        self.list_revisions = tk.Listbox(frame_content, width=32, exportselection=tk.FALSE)
+        for revision in self.revisions:
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(revision['time']))
+            self.list_revisions.insert(tk.END, f"{stamp}  {revision['size'] / 1024:8.1f} KB")
+        self.list_revisions.grid(row=0, column=0, sticky=tk.NS, padx=5, pady=5)
+        self.list_revisions.bind('<<ListboxSelect>>', self.show_diff)
+
+        # diff against the current text
+        self.text_diff = tk.Text(frame_content, width=96, height=32, wrap=tk.NONE)
+        self.text_diff.tag_configure('added', foreground='#22863a')
+        self.text_diff.tag_configure('removed', foreground='#d73a49')
+        self.text_diff.tag_configure('hunk', foreground='#6f6f6f')
+        self.text_diff.grid(row=0, column=1, sticky=tk.NSEW, padx=5, pady=5)
+
+        frame_content.pack(side=tk.TOP, expand=tk.TRUE, fill=tk.BOTH)
+
+        # buttons
+        frame_btns = ttk.Frame(self)
+        frame_btns.configure(borderwidth=8)
+
+        buttons = {
+            'Restore': self.restore,
+            'Close':   self.close
+        }
+
+        for text, cmd in buttons.items():
+            btn = ttk.Button(frame_btns, text=text, command=cmd, takefocus=tk.FALSE, width=8)
+            btn.pack(side=tk.LEFT, padx=5)
+
+        frame_btns.pack(side=tk.BOTTOM, fill=tk.X)
+
+    def selected(self):
+        selection = self.list_revisions.curselection()
+        return self.revisions[selection[0]] if selection else None
+
+    def show_diff(self, event=None):
+        """Show the changes between the selected revision and the current text. """
+        revision = self.selected()
+        if not revision:
+            return
+
+        self.text_diff.delete('1.0', tk.END)
+        for line in self.workspace.diff_revision(revision):
+            tag = {'+': 'added', '-': 'removed', '@': 'hunk'}.get(line[:1])
+            self.text_diff.insert(tk.END, line if line.endswith('\n') else line + '\n', tag)
+
+    def restore(self):
+        """Replace the text with the selected revision, then dismiss dialog. """
+        revision = self.selected()
+        if revision:
+            self.workspace.restore_revision(revision)
+        self.close()
+
+    def close(self, event=None):
+        """Dismiss revision dialog. """
+        self.grab_release()
+        self.destroy()
+
+
+#============================================================================
+# project search
+#============================================================================
+class SearchDialog(tk.Toplevel):
+    def __init__(self, parent, search, open_hit, title=None):
+        """Create search panel, it stays open next to the main window.
+        :param search: function query -> [(path, line, snippet), ...]
+        :param open_hit: function called with (path, line, query)
+        """
+        super().__init__(parent)
+
+        self.search_cb = search
+        self.open_cb = open_hit
+        self.hits = []
+        self._job = None
+
+        self.title(title or 'Search Project')
+        x = parent.winfo_rootx() + 40
+        y = parent.winfo_rooty() + 40
+        self.geometry(f'+{x}+{y}')
+
+        self.create_widgets()
+        self.transient(parent)
+
+        self.bind('<Escape>', self.close)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.entry_query.focus_set()
+
+    def create_widgets(self):
+        frame_content = ttk.Frame(self)
+        frame_content.rowconfigure(1, weight=1)
+        frame_content.columnconfigure(0, weight=1)
+
+        self.query = tk.StringVar(self)
+        self.query.trace_add('write', self.on_query_change)
+
+        self.entry_query = ttk.Entry(frame_content, textvariable=self.query)
+        self.entry_query.grid(row=0, column=0, sticky=tk.EW, padx=5, pady=5)
+        self.entry_query.bind('<Return>', self.open_selected)
+        self.entry_query.bind('<Down>', lambda e: self.list_hits.focus_set())
+
+        self.list_hits = tk.Listbox(frame_content, width=96, height=24, exportselection=tk.FALSE)
+        self.list_hits.grid(row=1, column=0, sticky=tk.NSEW, padx=5, pady=5)
+        self.list_hits.bind('<Double-Button-1>', self.open_selected)
+        self.list_hits.bind('<Return>', self.open_selected)
+
+        self.label_info = ttk.Label(frame_content)
+        self.label_info.grid(row=2, column=0, sticky=tk.W, padx=5, pady=5)
+
+        frame_content.pack(side=tk.TOP, expand=tk.TRUE, fill=tk.BOTH)
+
+    def on_query_change(self, *args):
+        # wait for a pause in typing
+        if self._job:
+            self.after_cancel(self._job)
+        self._job = self.after(150, self.search)
+
+    def search(self):
+        """Show the best matching blocks for the query. """
+        self._job = None
+        start = time.perf_counter()
+        self.hits = self.search_cb(self.query.get())
+        elapsed = (time.perf_counter() - start) * 1000
+
+        self.list_hits.delete(0, tk.END)
+        for path, line, snippet in self.hits:
+            self.list_hits.insert(tk.END, f"{os.path.basename(path)}:{line}  {snippet}")
+        if self.hits:
+            self.list_hits.selection_set(0)
+
+        self.label_info['text'] = f"{len(self.hits)} hits in {elapsed:.1f} ms"
+
+    def open_selected(self, event=None):
+        selection = self.list_hits.curselection()
+        if selection:
+            path, line, _ = self.hits[selection[0]]
+            self.open_cb(path, line, self.query.get())
+
+    def close(self, event=None):
+        """Dismiss search panel. """
+        self.destroy()
+
+#============================================================================
+# diagnostics
+#============================================================================
+class DiagnosticsDialog(tk.Toplevel):
+    def __init__(self, parent, diagnostics, save, title=None):
+        """Create diagnostics panel, it stays open next to the main window.
+        :param diagnostics: Diagnostics that creates the reports
+        :param save: function that saves a report as json
+        """
+        super().__init__(parent)
+
+        self.diagnostics = diagnostics
+        self.save_cb = save
+
+        self.title(title or 'Memory Diagnostics')
+        x = parent.winfo_rootx() + 40
+        y = parent.winfo_rooty() + 40
+        self.geometry(f'+{x}+{y}')
+
+        self.create_widgets()
+        self.transient(parent)
+
+        self.bind('<Escape>', self.close)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.refresh()
+
+    def create_widgets(self):
+        frame_content = ttk.Frame(self)
+        frame_content.rowconfigure(0, weight=1)
+        frame_content.columnconfigure(0, weight=1)
+
+        self.text_report = tk.Text(frame_content, width=80, height=32, wrap=tk.NONE)
+        self.text_report.grid(row=0, column=0, sticky=tk.NSEW, padx=5, pady=5)
+
+        frame_content.pack(side=tk.TOP, expand=tk.TRUE, fill=tk.BOTH)
+
+        # buttons
+        frame_btns = ttk.Frame(self, style='Buttonframe.TFrame')
+        frame_btns.configure(borderwidth=8)
+
+        self.button_trace = ttk.Button(frame_btns, command=self.toggle_tracing, takefocus=tk.FALSE, width=14)
+        self.button_trace.pack(side=tk.LEFT, padx=5)
+
+        buttons = {
+            'Refresh': self.refresh,
+            'Save':    self.save_cb,
+            'Close':   self.close
+        }
+
+        for text, cmd in buttons.items():
+            btn = ttk.Button(frame_btns, text=text, command=cmd, takefocus=tk.FALSE, width=8)
+            btn.pack(side=tk.LEFT, padx=5)
+
+        frame_btns.pack(side=tk.BOTTOM, expand=tk.TRUE, fill=tk.X)
+
+    def refresh(self):
+        """Show a new report. """
+        report = self.diagnostics.report()
+
+        self.text_report['state'] = tk.NORMAL
+        self.text_report.delete('1.0', tk.END)
+        self.text_report.insert('1.0', json.dumps(report, indent=2))
+        self.text_report['state'] = tk.DISABLED
+
+        tracing = report['tracemalloc']['tracing']
+        self.button_trace['text'] = 'Stop Tracing' if tracing else 'Start Tracing'
+
+    def toggle_tracing(self):
+        """Trace python allocations from now on, or stop tracing. """
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        else:
+            tracemalloc.start()
+        self.refresh()
+
+    def close(self, event=None):
+        """Dismiss diagnostics panel. """
+        self.destroy()
@@ -0,0 +1,91 @@
+import asyncio
+
+#============================================================================
+# asyncio bridge
+#============================================================================
+class AsyncBridge():
+    """ Runs an asyncio event loop on the Tk main loop.
+        The loop is advanced from Tk timers while tasks are pending, so
+        coroutines run on the Tk thread and may use widgets directly.
+        Blocking work belongs in asyncio.to_thread. """
+    def __init__(self, widget, interval: int = 10) -> None:
+        """
+        :param interval: milliseconds between advancing the event loop
+        """
+        self.widget = widget
+        self.interval = interval
+
+        self.loop = asyncio.new_event_loop()
+        self.tasks = {}     # key -> asyncio.Task
+        self._job = None
+
+    def run(self, coro, key: str = None, timeout: float = None) -> asyncio.Task:
+        """ Schedule a coroutine. A running task with the same key is cancelled,
+            after timeout seconds the coroutine is cancelled """
+        if timeout is not None:
+            coro = asyncio.wait_for(coro, timeout)
+
+        if key in self.tasks:
+            self.tasks[key].cancel()
+
+        task = self.loop.create_task(coro)
+        task.add_done_callback(self._report)
+        if key is not None:
+            self.tasks[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+
+        self._schedule()
+        return task
+
+    def running(self, key: str) -> bool:
+        return key in self.tasks
+
+    def cancel(self, key: str) -> None:
+        task = self.tasks.get(key)
+        if task:
+            task.cancel()
+
+    def close(self) -> None:
+        for task in asyncio.all_tasks(self.loop):
+            task.cancel()
+        self._step()
+        self.loop.close()
+
+        if self._job:
+            self.widget.after_cancel(self._job)
+            self._job = None
+
+    def _report(self, task: asyncio.Task) -> None:
+        """ Report failed tasks like failed Tk callbacks """
+        if task.cancelled() or task.exception() is None:
+            return
+        e = task.exception()
+        self.widget.report_callback_exception(type(e), e, e.__traceback__)
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        if self.tasks.get(key) is task:
+            del self.tasks[key]
+
+    def _schedule(self) -> None:
+        if self._job is None:
+            self._job = self.widget.after(0, self._pump)
+
+    def _step(self) -> None:
+        """ Run everything that is ready, without blocking """
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+
+    def _pump(self) -> None:
+        self._job = None
+
+        # a modal dialog opened by a coroutine runs a nested Tk event loop,
+        # the event loop continues once the dialog returns
+        if self.loop.is_running():
+            self._job = self.widget.after(self.interval, self._pump)
+            return
+
+        self._step()
+
+        # keep going while there is anything left to wait for
+        if asyncio.all_tasks(self.loop):
+            self._job = self.widget.after(self.interval, self._pump)
@@ -0,0 +1,157 @@
+import os, re, time, multiprocessing
+
+from multiprocessing import shared_memory
+
+from lib.tokenizer import RegexLexer, lex_block
+from lib.session import run_length_encode, run_length_decode
+
+# texts smaller than this (in bytes) are analyzed on the main loop as usual
+PARALLEL_MIN = 1 << 20
+
+WORD_PATTERN = re.compile(r'\w+')
+
+def usable_cores() -> int:
+    """ Number of cores this process may run on """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def split_chunks(data: bytes, count: int) -> list:
+    """ Split data at newlines into at most count (start, end, first line)
+        ranges of whole lines, the newlines between the chunks are left out """
+    chunks, start, line, size = [], 0, 1, len(data)
+    for i in range(1, count):
+        end = data.find(b'\n', max(size * i // count, start))
+        if end < 0:
+            break
+        chunks.append((start, end, line))
+        line += data.count(b'\n', start, end) + 1
+        start = end + 1
+
+    chunks.append((start, size, line))
+    return chunks
+
+def analyze_chunk(name: str, start: int, end: int, first: int, patterns: dict, regions: dict) -> tuple:
+    """ Lex and count the words of a chunk of the text in shared memory.
+        Lexing starts outside of any region at line first.
+        Returns (word count, tokens, run length encoded states) """
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        text = bytes(shm.buf[start:end]).decode('utf-8')
+    finally:
+        shm.close()
+
+    lines = text.split('\n')
+    tokens, states, _ = lex_block(RegexLexer(patterns, regions), first, None, lines, {})
+    return len(WORD_PATTERN.findall(text)), tokens, run_length_encode(states)
+
+#============================================================================
+# parallel analyzer
+#============================================================================
+class AnalysisResult():
+    """ Merged analysis of all chunks. The lines in speculative start a chunk
+        that was lexed outside of a region although the chunk before ended
+        inside one, they have to be lexed again """
+    def __init__(self) -> None:
+        self.words = 0
+        self.tokens = {}
+        self.states = []
+        self.speculative = []
+
+    def merge(self, words: int, tokens: dict, states: list) -> None:
+        """ Append the result of the next chunk """
+        if self.states and self.states[-1] is not None:
+            self.speculative.append(len(self.states) + 1)
+
+        self.words += words
+        for tag, ranges in tokens.items():
+            self.tokens.setdefault(tag, []).extend(ranges)
+        self.states.extend(run_length_decode(states))
+
+
+class ParallelAnalyzer():
+    """ Runs the first analysis of a large text on all cores. The text is put
+        into shared memory once and split into line aligned chunks, which a
+        process pool lexes and counts. Results are merged on the main loop.
+        The pool only lives as long as an analysis, idle workers would hold
+        a whole interpreter each. """
+    # seconds the pool may take to start
+    STARTUP = 10.0
+
+    def __init__(self, widget, processes: int = None, interval: int = 20) -> None:
+        """
+        :param interval: milliseconds between checks for finished chunks
+        """
+        self.widget = widget
+        self.processes = processes or usable_cores()
+        self.interval = interval
+
+        self._pool = None
+        self._shm = None
+        self._job = None
+
+    def start(self, text: str, patterns: dict, regions: dict, budget: float, callback) -> bool:
+        """ Analyze text in the background, callback is called with an
+            AnalysisResult, or None if the analysis failed.
+            Returns False if the text is too small to be worth it """
+        data = text.encode('utf-8')
+        if len(data) < PARALLEL_MIN or self.processes < 2:
+            return False
+
+        self.cancel()
+        chunks = split_chunks(data, self.processes)
+
+        context = multiprocessing.get_context('spawn')
+        self._pool = context.Pool(min(self.processes, len(chunks)))
+
+        self._shm = shared_memory.SharedMemory(create=True, size=len(data))
+        self._shm.buf[:len(data)] = data
+
+        results = [self._pool.apply_async(analyze_chunk, (self._shm.name, *chunk, patterns, regions))
+                   for chunk in chunks]
+
+        # the same budget per block of lines as the pattern worker
+        lines = text.count('\n') // len(chunks) + 1
+        deadline = time.perf_counter() + self.STARTUP + budget * (lines // 256 + 1)
+        self._job = self.widget.after(self.interval, self._poll, results, deadline, callback)
+        return True
+
+    def cancel(self) -> None:
+        if self._job:
+            self.widget.after_cancel(self._job)
+            self._job = None
+        self._release()
+
+    def close(self) -> None:
+        self.cancel()
+
+    def _release(self) -> None:
+        """ Stop the pool and free the shared memory """
+        if self._pool:
+            self._pool.terminate()
+            self._pool = None
+        if self._shm:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def _poll(self, results: list, deadline: float, callback) -> None:
+        self._job = None
+        if not all(r.ready() for r in results):
+            if time.perf_counter() < deadline:
+                self._job = self.widget.after(self.interval, self._poll, results, deadline, callback)
+                return
+
+            # a runaway pattern, leave it to the pattern worker
+            self._release()
+            return callback(None)
+
+        result = AnalysisResult()
+        try:
+            for r in results:
+                result.merge(*r.get())
+        except Exception:
+            result = None
+        finally:
+            self._release()
+        callback(result)
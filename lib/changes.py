@@ -0,0 +1,91 @@
+from array import array
+
+# state of a line compared to the saved version
+UNCHANGED, ADDED, MODIFIED = 0, 1, 2
+
+def line_hashes(text: str) -> array:
+    return array('q', map(hash, text.split('\n')))
+
+#============================================================================
+# change tracker
+#============================================================================
+class ChangeTracker():
+    """ Tracks which lines differ from the last saved version.
+        The saved version is kept as one hash per line and every line of the
+        text knows the saved line it stands for, so an edit only hashes the
+        lines it touched. Lines that were added store ~(saved line above + 1)
+        instead, which keeps the origins of all lines in order. """
+    def __init__(self, text) -> None:
+        self.text = text
+
+        self.baseline = line_hashes('')     # hash of each saved line
+        self.origins = array('q', [0])      # saved line of each line
+        self.states = bytearray(1)          # state of each line
+
+        text.add_change_listener(self.on_change)
+
+    def reset(self, saved: str, text: str = None) -> None:
+        """ Compare against saved from now on. text is the content of
+            the widget, if it was edited after saved was taken """
+        self.baseline = line_hashes(saved)
+        if text is None:
+            self.origins = array('q', range(len(self.baseline)))
+            self.states = bytearray(len(self.baseline))
+        else:
+            self.origins, self.states = self._align(line_hashes(text), -1, len(self.baseline))
+
+    def lines(self, first: int, last: int) -> bytes:
+        """ States of the lines [first, last) """
+        return bytes(self.states[first - 1:last - 1])
+
+    def counts(self) -> dict:
+        return {
+            'added': self.states.count(ADDED),
+            'modified': self.states.count(MODIFIED),
+        }
+
+    def on_change(self, change) -> None:
+        first = change.line - 1
+        last = first + change.old_line_count
+
+        # saved lines between the lines around the edit are free to match
+        prev = self._above(first - 1) if first else -1
+        end = self._below(last) if last < len(self.origins) else len(self.baseline)
+
+        hashes = line_hashes(change.new_text)
+        self.origins[first:last], self.states[first:last] = self._align(hashes, prev, end)
+
+    def _above(self, index: int) -> int:
+        """ Last saved line at or above line index """
+        origin = self.origins[index]
+        return origin if origin >= 0 else ~origin - 1
+
+    def _below(self, index: int) -> int:
+        """ First saved line line index may stand for """
+        origin = self.origins[index]
+        return origin if origin >= 0 else ~origin
+
+    def _align(self, hashes: array, prev: int, end: int) -> tuple:
+        """ Match lines to the saved lines (prev, end). Equal lines at the
+            start and the end match as unchanged, the lines in between are
+            matched in order as modified and the rest is added """
+        lo, hi = prev + 1, max(end, prev + 1)
+        i, j = 0, len(hashes)
+        while i < j and lo < hi and hashes[i] == self.baseline[lo]:
+            i, lo = i + 1, lo + 1
+        while i < j and lo < hi and hashes[j - 1] == self.baseline[hi - 1]:
+            j, hi = j - 1, hi - 1
+
+        middle = min(j - i, hi - lo)
+        origins = array('q', range(lo - i, lo + middle))
+        origins.extend([~(lo + middle)] * (j - i - middle))
+        origins.extend(range(hi, hi + len(hashes) - j))
+
+        states = bytearray(len(hashes))
+        for k in range(i, j):
+            origin = origins[k]
+            if origin < 0:
+                states[k] = ADDED
+            elif hashes[k] != self.baseline[origin]:
+                states[k] = MODIFIED
+        return origins, states
@@ -0,0 +1,102 @@
+import os, re, sys, json, time, tracemalloc
+
+def process_memory() -> dict:
+    """ Resident and peak memory of the process in bytes, where available """
+    memory = {}
+    try:
+        with open('/proc/self/statm') as f:
+            memory['rss'] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes elsewhere
+        memory['peak_rss'] = peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+    return memory
+
+#============================================================================
+# diagnostics
+#============================================================================
+class Diagnostics():
+    """ Collects where the memory of the editor goes. Besides the text
+        widget itself, components register a function that returns their
+        sizes, e.g. the number of cached entries and bytes they hold. """
+    def __init__(self, text) -> None:
+        self.text = text
+        self.sources = {}       # name -> function returning a json serializable value
+
+    def register(self, name: str, source) -> None:
+        self.sources[name] = source
+
+    def unregister(self, name: str) -> None:
+        self.sources.pop(name, None)
+
+    def buffer(self) -> dict:
+        chars = self.text.count('1.0', 'end-1c', 'chars')
+        return {
+            'chars': chars[0] if chars else 0,
+            'lines': int(self.text.index('end-1c').split('.')[0]),
+            'marks': len(self.text.mark_names()),
+            'peers': len(self.text.peers),
+        }
+
+    def tags(self) -> dict:
+        """ Number of ranges of every tag """
+        return {tag: len(self.text.tag_ranges(tag)) // 2 for tag in self.text.tag_names()}
+
+    def after_callbacks(self) -> dict:
+        """ Pending 'after' callbacks grouped by the callback they run """
+        callbacks = {}
+        for job in self.text.tk.splitlist(self.text.tk.call('after', 'info')):
+            script = str(self.text.tk.splitlist(self.text.tk.call('after', 'info', job))[0])
+            # python callbacks are registered as <id><function name>
+            name = re.sub(r'^\d+', '', script.split()[0]) if script else ''
+            callbacks[name] = callbacks.get(name, 0) + 1
+        return {'pending': sum(callbacks.values()), 'callbacks': callbacks}
+
+    def allocations(self, limit: int = 20) -> list:
+        """ Lines that allocated the most memory since tracing started """
+        if not tracemalloc.is_tracing():
+            return []
+
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ])
+        return [{
+            'where': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+            'size': stat.size,
+            'count': stat.count,
+        } for stat in snapshot.statistics('lineno')[:limit]]
+
+    def report(self) -> dict:
+        caches = {}
+        for name, source in self.sources.items():
+            try:
+                caches[name] = source()
+            except Exception as e:
+                caches[name] = {'error': str(e)}
+
+        traced = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else None
+        return {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'process': process_memory(),
+            'buffer': self.buffer(),
+            'tags': self.tags(),
+            'after': self.after_callbacks(),
+            'caches': caches,
+            'tracemalloc': {
+                'tracing': traced is not None,
+                'current': traced[0] if traced else None,
+                'peak': traced[1] if traced else None,
+                'allocations': self.allocations(),
+            },
+        }
+
+    def dump(self, path: str) -> None:
+        """ Write the report as json """
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
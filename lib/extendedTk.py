@@ -1,6 +1,7 @@
 import tkinter as tk
 
 from tkinter import ttk, TclError
+from typing import NamedTuple
 
 class ExtendedMenu(tk.Menu):
     def __init__(self, master=None, **kw):
@@ -40,10 +41,100 @@ class FadingLabel(ttk.Label):
         super().__init__(master=master, **kw)
         self._idle_text = self["text"]
         self._delay = delay
+        self._job = None
 
     def write(self, msg):
         self["text"] = msg
-        self.after(self._delay, lambda: self.config(text=self._idle_text))
+
+        # restart the delay, every message gets the full time
+        if self._job:
+            self.after_cancel(self._job)
+        self._job = self.after(self._delay, self._fade)
+
+    def _fade(self):
+        self._job = None
+        self.config(text=self._idle_text)
+
+class CompletionPopup(tk.Listbox):
+    """ Listbox that shows completions below the insert cursor of a text widget """
+    def __init__(self, text, max_height=8, **kw):
+        super().__init__(master=text, activestyle=tk.NONE, exportselection=False, **kw)
+        self.text = text
+        self.max_height = max_height
+
+    def show(self, words: list) -> None:
+        bbox = self.text.bbox('insert')
+        if not words or not bbox:
+            return self.hide()
+
+        self.delete(0, tk.END)
+        self.insert(tk.END, *words)
+        self['height'] = min(len(words), self.max_height)
+        self.select(0)
+
+        x, y, _, height = bbox
+        self.place(x=x, y=y + height)
+
+    def hide(self) -> None:
+        self.place_forget()
+
+    def visible(self) -> bool:
+        return bool(self.winfo_manager())
+
+    def select(self, index: int) -> None:
+        index %= self.size()
+        self.selection_clear(0, tk.END)
+        self.selection_set(index)
+        self.see(index)
+
+    def move(self, delta: int) -> None:
+        selected = self.curselection()
+        self.select((selected[0] if selected else 0) + delta)
+
+    def selected(self) -> str:
+        selected = self.curselection()
+        return self.get(selected[0]) if selected else None
+
+class ChangeGutter(tk.Canvas):
+    """ Narrow bar next to a text widget that marks the visible lines by
+        state, e.g. lines changed since the last save """
+    def __init__(self, master, text, width=4, **kw):
+        super().__init__(master, width=width, highlightthickness=0, borderwidth=0, **kw)
+        self.text = text
+        self.source = None      # function (first, last) -> state of each line
+        self.colors = {}        # state -> color, states without color are not drawn
+        self._job = None
+
+        text.add_change_listener(lambda _: self.schedule())
+        self.bind('<Configure>', lambda _: self.schedule())
+
+    def schedule(self) -> None:
+        """ Redraw once the widget is idle """
+        if self._job is None:
+            self._job = self.after_idle(self.redraw)
+
+    def redraw(self) -> None:
+        self._job = None
+        self.delete('all')
+        if self.source is None:
+            return
+
+        first = int(self.text.index('@0,0').split('.')[0])
+        last = int(self.text.index(f'@0,{self.text.winfo_height()}').split('.')[0])
+        offset = self.text.winfo_rooty() - self.winfo_rooty()
+        width = self.winfo_width()
+
+        for line, state in enumerate(self.source(first, last + 1), first):
+            color = self.colors.get(state)
+            if not color:
+                continue
+
+            # a wrapped line spans several display lines
+            top = self.text.dlineinfo(f'{line}.0')
+            bottom = self.text.dlineinfo(f'{line}.0 lineend')
+            y0 = top[1] if top else 0
+            y1 = bottom[1] + bottom[3] if bottom else self.text.winfo_height()
+            self.create_rectangle(0, y0 + offset, width, y1 + offset, fill=color, width=0)
 
 class DigitEntry(ttk.Entry):
     def __init__(self, master=None, **kw):
@@ -102,11 +193,123 @@ class ThemedText(tk.Text):
 
         self.configure(config)
 
+class TextChange(NamedTuple):
+    """ Edit delta reported by ExtendedText. head and tail complete the lines
+        touched by the edit, so listeners never have to query the widget. """
+    kind: str       # 'insert' or 'delete'
+    line: int       # line of the first changed character
+    column: int     # column of the first changed character
+    chars: str      # the inserted or deleted characters
+    head: str       # text between the start of the line and the change
+    tail: str       # text between the change and the end of its last line
+
+    @property
+    def old_text(self) -> str:
+        """ the affected lines before the change """
+        chars = self.chars if self.kind == 'delete' else ''
+        return self.head + chars + self.tail
+
+    @property
+    def new_text(self) -> str:
+        """ the affected lines after the change """
+        chars = self.chars if self.kind == 'insert' else ''
+        return self.head + chars + self.tail
+
+    @property
+    def old_line_count(self) -> int:
+        return self.old_text.count('\n') + 1
+
+    @property
+    def new_line_count(self) -> int:
+        return self.new_text.count('\n') + 1
+
+
+# options a peer copies from the text it was created from
+PEER_OPTIONS = (
+    'font', 'width', 'wrap', 'tabs', 'spacing1', 'spacing2', 'spacing3',
+    'background', 'foreground', 'insertbackground', 'selectbackground',
+    'selectforeground', 'padx', 'pady', 'borderwidth', 'relief'
+)
+
+# Tcl procedures for batched operations. They work on the original widget
+# command, so a batch costs a single call from Python no matter its size.
+# Indices are passed as integers and only turned into strings in Tcl.
+BATCH_PROCS = r"""
+namespace eval ::capricorn {}
+
+# remove tags from the line ranges {first last} in clear, then add the
+# spans {line start end} of each {tag spans} in ranges
+proc ::capricorn::tag_lines {w tags clear ranges} {
+    foreach tag $tags {
+        foreach lines $clear {
+            lassign $lines first last
+            $w tag remove $tag $first.0 $last.0
+        }
+    }
+    foreach {tag spans} [concat {*}$ranges] {
+        set indices {}
+        foreach span $spans {
+            lassign $span line start end
+            lappend indices $line.$start $line.$end
+        }
+        if {[llength $indices]} {
+            $w tag add $tag {*}$indices
+        }
+    }
+}
+
+# apply {insert line column chars} and {delete line column line column}
+# edits, returns {kind index chars head tail} of each edit made
+proc ::capricorn::edit {w ops} {
+    set changes {}
+    foreach op $ops {
+        lassign $op kind line column arg1 arg2
+        set index [::capricorn::clamp $w $line.$column]
+        if {$kind eq "insert"} {
+            set chars $arg1
+            set head [$w get "$index linestart" $index]
+            set tail [$w get $index "$index lineend"]
+            $w insert $index $chars
+        } else {
+            set index2 [::capricorn::clamp $w $arg1.$arg2]
+            if {![$w compare $index < $index2]} continue
+            set chars [$w get $index $index2]
+            set head [$w get "$index linestart" $index]
+            set tail [$w get $index2 "$index2 lineend"]
+            $w delete $index $index2
+        }
+        lappend changes [list $kind $index $chars $head $tail]
+    }
+    return $changes
+}
+
+# resolve an index, the final newline can not be edited
+proc ::capricorn::clamp {w index} {
+    set index [$w index $index]
+    if {[$w compare $index > end-1c]} {
+        return [$w index end-1c]
+    }
+    return $index
+}
+"""
+
+def text_end(line: int, column: int, chars: str) -> tuple:
+    """ (line, column) behind chars inserted at line.column """
+    lines = chars.count('\n')
+    if lines:
+        return line + lines, len(chars) - chars.rfind('\n') - 1
+    return line, column + len(chars)
+
 class ExtendedText(ThemedText):
     def __init__(self, master=None, **kw):
         """A text widget that report on internal widget commands"""
         super().__init__(master=master, **kw)
 
+        self._change_listeners = []
+        self._history = None
+        self.change_count = 0
+        self.peers = []
+
         # create a proxy for the underlying widget
         self._orig = self._w + "_orig"
         self.tk.call("rename", self._w, self._orig)
@@ -116,6 +319,9 @@ class ExtendedText(ThemedText):
         self._register_tk_proxy('mark', self._proxy_mark)
         self._register_tk_proxy('insert', self._proxy_insert)
         self._register_tk_proxy('delete', self._proxy_delete)
+        self._register_tk_proxy('edit', self._proxy_edit)
+
+        self.tk.eval(BATCH_PROCS)
 
     #============================================================================
     # tk functions
@@ -146,8 +352,13 @@ class ExtendedText(ThemedText):
         self.event_generate("<<insert-moved>>")
 
     def _proxy_insert(self, index, chars, tags=None):
+        index = self._clamp_index(index)
+        head = self._orig_call('get', f"{index} linestart", index)
+        tail = self._orig_call('get', index, f"{index} lineend")
+
         self._orig_call('insert', index, chars, tags)
 
+        self._notify_change('insert', index, chars, head, tail)
         self.event_generate("<<text-changed>>")
         self.event_generate("<<insert-moved>>")
 
@@ -156,13 +367,154 @@ class ExtendedText(ThemedText):
         if index1.startswith("sel.") and not self.tag_ranges("sel"):
             return
 
+        index1 = self._clamp_index(index1)
+        index2 = self._clamp_index(index2 or f"{index1}+1c")
+        if not self.compare(index1, '<', index2):
+            return
+
+        chars = self._orig_call('get', index1, index2)
+        head = self._orig_call('get', f"{index1} linestart", index1)
+        tail = self._orig_call('get', index2, f"{index2} lineend")
+
         self._orig_call('delete', index1, index2)
 
+        self._notify_change('delete', index1, chars, head, tail)
         self.event_generate("<<text-changed>>")
         self.event_generate("<<insert-moved>>")
 
+    def _proxy_edit(self, command, *args):
+        # forward undo commands to an external history if there is one
+        if self._history is not None and command in ('undo', 'redo', 'reset', 'separator'):
+            return getattr(self._history, command)()
+        return self._orig_call('edit', command, *args)
+
+    #============================================================================
+    # batched operations
+    #============================================================================
+    def tag_lines(self, tags, clear, ranges: dict) -> None:
+        """ Remove tags from the (first, last) line ranges in clear and add
+            the (line, start, end) spans of ranges, a dict tag -> spans.
+            Everything happens in a single Tcl call. """
+        self.tk.call('::capricorn::tag_lines', self._orig,
+                     tuple(tags), tuple(clear), tuple(ranges.items()))
+
+    def edit_batch(self, ops) -> None:
+        """ Apply ('insert', line, column, chars) and ('delete', line, column,
+            end line, end column) edits in order in a single Tcl call.
+            Listeners get a TextChange per edit, events are generated once. """
+        changes = self.tk.splitlist(self.tk.call('::capricorn::edit', self._orig, tuple(ops)))
+        for change in changes:
+            kind, index, chars, head, tail = map(str, self.tk.splitlist(change))
+            self._notify_change(kind, index, chars, head, tail)
+
+        if changes:
+            self.event_generate("<<text-changed>>")
+            self.event_generate("<<insert-moved>>")
+
+    #============================================================================
+    # change listeners
+    #============================================================================
+    def add_change_listener(self, callback) -> None:
+        """ register a callback that receives a TextChange for every edit """
+        self._change_listeners.append(callback)
+
+    def remove_change_listener(self, callback) -> None:
+        self._change_listeners.remove(callback)
+
+    def set_history(self, history) -> None:
+        """ replace Tk's undo stack with an object that implements the
+            undo, redo, reset and separator subcommands of 'edit' """
+        self._history = history
+        self._orig_call('configure', '-undo', 0)
+
+    def _clamp_index(self, index) -> str:
+        """ resolve an index, the final newline can not be edited """
+        index = self._orig_call('index', index)
+        last = self._orig_call('index', 'end-1c')
+        return last if self.compare(index, '>', last) else index
+
+    def _notify_change(self, kind, index, chars, head, tail) -> None:
+        line, column = map(int, index.split('.'))
+        change = TextChange(kind, line, column, chars, head, tail)
+        self.change_count += 1
+        for callback in self._change_listeners:
+            callback(change)
+
     #============================================================================
     # other functions
     #============================================================================
+    def create_peer(self, master, **kw) -> 'TextPeer':
+        """ Create a second view on this text, see TextPeer """
+        peer = TextPeer(master, self, **kw)
+        self.peers.append(peer)
+        self.sync_peers()
+        return peer
+
+    def remove_peer(self, peer: 'TextPeer') -> None:
+        self.peers.remove(peer)
+        peer.destroy()
+
+    def sync_peers(self) -> None:
+        """ Copy the appearance of this widget to its peers """
+        options = {k: self.cget(k) for k in PEER_OPTIONS}
+        for peer in self.peers:
+            peer.configure(options)
+
     def set_tab_size(self, size):
-        self['tabs'] = self.tk.call("font", "measure", self['font'], size * ' ')
\ No newline at end of file
+        self['tabs'] = self.tk.call("font", "measure", self['font'], size * ' ')
+
+class TextPeer(tk.Text):
+    """ Text widget created with 'peer create' that shares the text and tags
+        of an ExtendedText. Edits are forwarded to the proxies of the owner, so
+        change listeners run once per edit no matter which pane was edited. """
+    def __init__(self, master, owner: ExtendedText, **kw):
+        self.owner = owner
+        self.widgetName = 'text'
+        self._setup(master, {})
+        owner._orig_call('peer', 'create', self._w, *self._options(kw))
+
+        # create a proxy, but keep our own marks and selection
+        self._orig = self._w + "_orig"
+        self.tk.call("rename", self._w, self._orig)
+        self.tk.createcommand(self._w, self._dispatch_tk_proxy)
+
+        self._tk_proxies = {
+            'mark':   self._proxy_mark,
+            'insert': self._proxy_insert,
+            'delete': self._proxy_delete,
+            'edit':   owner._proxy_edit,
+        }
+
+    def destroy(self):
+        super().destroy()
+        self.tk.deletecommand(self._w)
+
+    def _orig_call(self, command, *args):
+        return self.tk.call((self._orig, command) + args)
+
+    def _dispatch_tk_proxy(self, command, *args):
+        f = self._tk_proxies.get(command)
+        try:
+            if f: return f(*args)
+            return self._orig_call(command, *args)
+        except TclError:
+            pass
+
+    def _proxy_mark(self, *args):
+        self._orig_call('mark', *args)
+
+        self.event_generate("<<insert-moved>>")
+
+    def _proxy_insert(self, index, chars, tags=None):
+        # resolve indices here, 'insert' and 'sel' belong to this peer
+        self.owner._proxy_insert(self._orig_call('index', index), chars, tags)
+        self.event_generate("<<insert-moved>>")
+
+    def _proxy_delete(self, index1, index2=None):
+        if index1.startswith("sel.") and not self.tag_ranges("sel"):
+            return
+
+        index1 = self._orig_call('index', index1)
+        index2 = self._orig_call('index', index2) if index2 else None
+        self.owner._proxy_delete(index1, index2)
+        self.event_generate("<<insert-moved>>")
@@ -0,0 +1,259 @@
+import json, time, zlib, tempfile
+
+from contextlib import contextmanager
+
+from lib.extendedTk import text_end
+
+# approximate per operation overhead in bytes
+OP_OVERHEAD = 64
+
+#============================================================================
+# undo group
+#============================================================================
+class UndoGroup():
+    """ Operations that are undone and redone together.
+        Old groups store their operations compressed or spilled to disk. """
+    __slots__ = ('ops', 'size', 'blob', 'spill', 'time')
+
+    def __init__(self) -> None:
+        self.ops = []       # list of (kind, line, column, chars)
+        self.size = 0       # raw size in bytes
+        self.blob = None    # compressed operations
+        self.spill = None   # (offset, length) in the spill file
+        self.time = time.monotonic()
+
+    def add(self, kind: str, line: int, column: int, chars: str) -> None:
+        self.ops.append((kind, line, column, chars))
+        self.size += len(chars) + OP_OVERHEAD
+        self.time = time.monotonic()
+
+    def memory(self) -> int:
+        if self.ops is not None:
+            return self.size
+        return len(self.blob) if self.blob is not None else 0
+
+    def compress(self) -> None:
+        self.blob = zlib.compress(json.dumps(self.ops).encode('utf-8'))
+        self.ops = None
+
+    def write(self, file) -> None:
+        file.seek(0, 2)
+        self.spill = (file.tell(), len(self.blob))
+        file.write(self.blob)
+        self.blob = None
+
+    def read(self, file) -> list:
+        """ Returns the operations without changing how they are stored """
+        if self.ops is not None:
+            return self.ops
+
+        blob = self.blob
+        if blob is None:
+            offset, length = self.spill
+            file.seek(offset)
+            blob = file.read(length)
+        return [tuple(op) for op in json.loads(zlib.decompress(blob))]
+
+    def load(self, file) -> list:
+        """ Returns the operations and keeps them uncompressed in memory """
+        self.ops = self.read(file)
+        self.blob = None
+        self.spill = None
+        return self.ops
+
+    def continues(self, kind: str, line: int, column: int, chars: str) -> bool:
+        """ Check if an operation directly continues the last one """
+        last_kind, last_line, last_column, last_chars = self.ops[-1]
+        if '\n' in chars or '\n' in last_chars:
+            return False
+
+        if kind == 'insert':
+            # typing or replacing a deleted selection
+            if last_kind == 'insert':
+                return (line, column) == (last_line, last_column + len(last_chars))
+            return (line, column) == (last_line, last_column)
+
+        if last_kind != 'delete':
+            return False
+        # backspace or forward delete
+        return (line, column + len(chars)) == (last_line, last_column) or \
+               (line, column) == (last_line, last_column)
+
+
+#============================================================================
+# undo manager
+#============================================================================
+class UndoManager():
+    """ Memory bounded undo history fed by the edit deltas of an ExtendedText """
+    def __init__(self, text, budget: int = 16 * 1024 * 1024, delay: float = 1.0) -> None:
+        """
+        :param budget: memory in bytes the history may use before old groups
+                       are compressed and spilled to disk
+        :param delay: pause in seconds after which typing starts a new group
+        """
+        self.text = text
+        self.budget = budget
+        self.delay = delay
+
+        self.undo_stack = []
+        self.redo_stack = []
+        self._memory = 0
+        self._open = False          # last group accepts more operations
+        self._batched = 0           # depth of nested batch() blocks
+        self._replaying = False
+        self._paused = False
+        self._compressed = 0        # number of compressed groups at the bottom of the stack
+        self._spilled = 0           # number of spilled groups at the bottom of the stack
+        self._spill_file = None
+
+        text.add_change_listener(self.on_change)
+        text.set_history(self)
+
+    def __len__(self) -> int:
+        return len(self.undo_stack)
+
+    def memory(self) -> int:
+        """ Returns the bytes held in memory by the history """
+        return self._memory
+
+    def stats(self) -> dict:
+        return {
+            'depth': len(self.undo_stack),
+            'redo_depth': len(self.redo_stack),
+            'memory': self._memory,
+            'budget': self.budget,
+            'compressed': self._compressed,
+            'spilled': self._spilled,
+        }
+
+    def on_change(self, change) -> None:
+        if self._replaying or self._paused:
+            return
+
+        self._memory -= sum(group.memory() for group in self.redo_stack)
+        self.redo_stack.clear()
+
+        args = (change.kind, change.line, change.column, change.chars)
+        group = self.undo_stack[-1] if self._open and self.undo_stack else None
+        if group is None or not self._batched and \
+           (time.monotonic() - group.time > self.delay or not group.continues(*args)):
+            group = UndoGroup()
+            self.undo_stack.append(group)
+            self._enforce_budget()
+
+        group.add(*args)
+        self._memory += len(change.chars) + OP_OVERHEAD
+        self._open = True
+
+    @contextmanager
+    def batch(self):
+        """ Group all edits made inside the with block into one undo step """
+        self.separator()
+        self._batched += 1
+        try:
+            yield
+        finally:
+            self._batched -= 1
+            self.separator()
+
+    @contextmanager
+    def paused(self):
+        """ Replace the whole text inside the with block without recording it.
+            The history is cleared, it does not fit the new text """
+        self.reset()
+        self._paused = True
+        try:
+            yield
+        finally:
+            self._paused = False
+
+    #============================================================================
+    # tk 'edit' subcommands
+    #============================================================================
+    def separator(self) -> None:
+        self._open = False
+
+    def reset(self) -> None:
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self._memory = 0
+        self._open = False
+        self._compressed = 0
+        self._spilled = 0
+
+        if self._spill_file:
+            self._spill_file.close()
+            self._spill_file = None
+
+    def undo(self) -> None:
+        if not self.undo_stack:
+            return
+        group = self._pop(self.undo_stack)
+
+        self._replay(reversed(group.ops), inverse=True)
+        self.redo_stack.append(group)
+
+    def redo(self) -> None:
+        if not self.redo_stack:
+            return
+        self._open = False
+        group = self.redo_stack.pop()
+
+        self._replay(group.ops, inverse=False)
+        self.undo_stack.append(group)
+        self._enforce_budget()
+
+    #============================================================================
+    # internals
+    #============================================================================
+    def _pop(self, stack: list) -> UndoGroup:
+        self._open = False
+        group = stack.pop()
+
+        memory = group.memory()
+        group.load(self._spill_file)
+        self._memory += group.memory() - memory
+
+        self._compressed = min(self._compressed, len(stack))
+        self._spilled = min(self._spilled, len(stack))
+        return group
+
+    def _replay(self, ops, inverse: bool) -> None:
+        edits, insert = [], None
+        for kind, line, column, chars in ops:
+            end = text_end(line, column, chars)
+            if (kind == 'insert') != inverse:
+                edits.append(('insert', line, column, chars))
+                insert = end
+            else:
+                edits.append(('delete', line, column) + end)
+                insert = line, column
+
+        self._replaying = True
+        try:
+            self.text.edit_batch(edits)
+        finally:
+            self._replaying = False
+
+        if insert:
+            self.text.mark_set('insert', '%d.%d' % insert)
+            self.text.see('insert')
+
+    def _enforce_budget(self) -> None:
+        """ Compress and then spill the oldest groups until the budget is met.
+            The newest group always stays uncompressed. """
+        while self._memory > self.budget and self._compressed < len(self.undo_stack) - 1:
+            group = self.undo_stack[self._compressed]
+            self._memory -= group.memory()
+            group.compress()
+            self._memory += group.memory()
+            self._compressed += 1
+
+        while self._memory > self.budget and self._spilled < self._compressed:
+            if self._spill_file is None:
+                self._spill_file = tempfile.TemporaryFile(prefix='capricorn-undo-')
+
+            group = self.undo_stack[self._spilled]
+            self._memory -= group.memory()
+            group.write(self._spill_file)
+            self._spilled += 1
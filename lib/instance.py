@@ -0,0 +1,106 @@
+import os, json, queue, socket, tempfile, threading
+
+def socket_path() -> str:
+    """ Per user socket of the running instance """
+    folder = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    user = os.getuid() if hasattr(os, 'getuid') else os.environ.get('USERNAME', 'user')
+    return os.path.join(folder, f'capricorn-{user}.sock')
+
+def supported() -> bool:
+    return hasattr(socket, 'AF_UNIX')
+
+def forward(args: list, timeout: float = 1.0) -> bool:
+    """ Hand args over to a running instance.
+        Returns True if an instance accepted them """
+    if not supported():
+        return False
+
+    message = json.dumps({'args': [os.path.abspath(a) for a in args]}) + '\n'
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(timeout)
+            s.connect(socket_path())
+            s.sendall(message.encode('utf-8'))
+            return s.makefile('r', encoding='utf-8').readline().strip() == 'ok'
+    except OSError:
+        return False
+
+#============================================================================
+# instance server
+#============================================================================
+class InstanceServer():
+    """ Accepts the arguments of later launches and calls back with them on
+        the Tk main loop """
+    def __init__(self, widget, callback, interval: int = 100) -> None:
+        """
+        :param callback: called with the list of arguments of a later launch
+        """
+        self.widget = widget
+        self.callback = callback
+        self.interval = interval
+
+        self.path = socket_path()
+        self._socket = None
+        self._requests = queue.Queue()
+        self._job = None
+
+    def start(self) -> bool:
+        """ Start listening, returns False if another instance is listening """
+        if not supported() or self._socket:
+            return False
+
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            try:
+                s.bind(self.path)
+            except OSError:
+                # the socket file is left over unless someone answers
+                if forward([]):
+                    s.close()
+                    return False
+                os.unlink(self.path)
+                s.bind(self.path)
+            s.listen()
+        except OSError:
+            s.close()
+            return False
+
+        self._socket = s
+        threading.Thread(target=self._serve, args=(s,), daemon=True).start()
+        self._job = self.widget.after(self.interval, self._poll)
+        return True
+
+    def close(self) -> None:
+        if not self._socket:
+            return
+
+        self._socket.close()
+        self._socket = None
+        if self._job:
+            self.widget.after_cancel(self._job)
+            self._job = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def _serve(self, s: socket.socket) -> None:
+        while True:
+            try:
+                conn, _ = s.accept()
+            except OSError:
+                return  # closed
+
+            with conn:
+                try:
+                    conn.settimeout(1.0)
+                    request = json.loads(conn.makefile('r', encoding='utf-8').readline())
+                    self._requests.put(request.get('args', []))
+                    conn.sendall(b'ok\n')
+                except (OSError, ValueError):
+                    pass
+
+    def _poll(self) -> None:
+        self._job = self.widget.after(self.interval, self._poll)
+        while not self._requests.empty():
+            self.callback(self._requests.get())
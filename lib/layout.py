@@ -0,0 +1,207 @@
+import tkinter.font as tkfont
+
+#============================================================================
+# font metrics
+#============================================================================
+class FontMetrics():
+    """ Caches the widths of words in a font. For fixed width fonts no words
+        are measured at all, everything else is measured once per word. """
+    def __init__(self, root, spec) -> None:
+        self.font = tkfont.Font(root=root, font=spec)
+
+        metrics = self.font.metrics()
+        self.linespace = metrics['linespace']
+        self.fixed = bool(metrics['fixed'])
+        self.char_width = self.font.measure('0')
+        self.space = self.font.measure(' ')
+
+        self.widths = {}
+
+    def measure(self, word: str) -> int:
+        if self.fixed:
+            return len(word) * self.char_width
+
+        width = self.widths.get(word)
+        if width is None:
+            width = self.widths[word] = self.font.measure(word)
+        return width
+
+    def count_lines(self, paragraph: str, width: int) -> int:
+        """ Number of lines paragraph wraps into at word boundaries """
+        lines, x = 1, 0
+        for word in paragraph.split(' '):
+            w = self.measure(word)
+            if x and x + self.space + w > width:
+                lines += 1
+                x = 0
+
+            x += (self.space if x else 0) + w
+            # words wider than a line are broken
+            if x > width:
+                lines += x // width
+                x %= width
+        return lines
+
+
+#============================================================================
+# layout engine
+#============================================================================
+class LayoutEngine():
+    """ Estimates the pages a text fills on paper. Paragraphs (text lines)
+        are only broken into lines again when they or their style changed,
+        the page count is computed from the cached line counts. Styles follow
+        the tokens of the tokenizer, see on_tokens. Pages are counted in
+        blocks of paragraphs, a block is only counted again when it changed
+        or starts at another height on its page. """
+    FETCH_LINES = 256
+    PAGE_BLOCK = 1024
+
+    def __init__(self, text) -> None:
+        self.text = text
+
+        self.fonts = {}                 # font spec -> FontMetrics
+        self.tags = {}
+        self.font_tags = []
+        self.body = None
+        self.pages = 0
+
+        self.paragraphs = [None]        # (lines, line height, spacing, tag) of each paragraph
+        self.styles = [None]            # tag that sets the font of each paragraph
+        self.dirty = bytearray(b'\1')
+
+        self.blocks = [None]            # (start height, page breaks, end height) of each block
+        self.stale = bytearray(b'\1')   # blocks that have to be counted again
+
+        text.add_change_listener(self.on_change)
+
+    def metrics(self, spec) -> FontMetrics:
+        metrics = self.fonts.get(spec)
+        if metrics is None:
+            metrics = self.fonts[spec] = FontMetrics(self.text, spec)
+        return metrics
+
+    def configure(self, config: dict, tags: dict) -> None:
+        """ Set the page geometry and fonts, everything is laid out again """
+        dpi = self.text.winfo_fpixels('1i')
+        margin = float(config['margin']) * dpi
+
+        self.width = int(float(config['page_width']) * dpi - 2 * margin)
+        self.height = int(float(config['page_height']) * dpi - 2 * margin)
+        self.spacing = float(config['line_spacing'])
+
+        self.fonts.clear()
+        self.body = self.metrics(config['font'])
+        self.tags = tags
+        self.font_tags = [tag for tag, settings in tags.items() if 'font' in settings]
+        self.styles = self._line_styles()
+        self.dirty = bytearray(b'\1' * len(self.paragraphs))
+
+    def on_change(self, change) -> None:
+        first = change.line - 1
+        last = first + change.old_line_count
+
+        # edited lines keep their style until they are highlighted again
+        styles = [self.styles[first]] * change.new_line_count
+        self.paragraphs[first:last] = [None] * change.new_line_count
+        self.styles[first:last] = styles
+        self.dirty[first:last] = b'\1' * change.new_line_count
+
+        # the following paragraphs moved to other blocks
+        if change.new_line_count != change.old_line_count:
+            count = (len(self.paragraphs) - 1) // self.PAGE_BLOCK + 1
+            block = first // self.PAGE_BLOCK
+            self.blocks[block:] = [None] * (count - block)
+            self.stale[block:] = b'\1' * (count - block)
+
+    def on_tokens(self, first: int, last: int, tokens: dict) -> None:
+        """ The lines [first, last) were highlighted again, lay out those
+            whose style changed. Tokens are (line, start, end) per tag """
+        if tokens is None:
+            styles = self._line_styles()[first - 1:last - 1]
+        else:
+            styles = [None] * (last - first)
+            for tag in self.font_tags:
+                for line, start, end in tokens.get(tag, ()):
+                    # lines whose first character is tagged
+                    if start == 0 and end > 0 and styles[line - first] is None:
+                        styles[line - first] = tag
+
+        for i, style in enumerate(styles, first - 1):
+            if self.styles[i] != style:
+                self.styles[i] = style
+                self.dirty[i] = 1
+
+    def _line_styles(self) -> list:
+        """ Returns the style of every line as highlighted in the text """
+        styles = [None] * len(self.paragraphs)
+        for tag in self.font_tags:
+            ranges = [tuple(map(int, str(i).split('.'))) for i in self.text.tag_ranges(tag)]
+            for (l1, c1), (l2, c2) in zip(ranges[::2], ranges[1::2]):
+                # lines whose first character is inside the range
+                for line in range(l1 if c1 == 0 else l1 + 1, l2 + 1 if c2 > 0 else l2):
+                    if styles[line - 1] is None:
+                        styles[line - 1] = tag
+        return styles
+
+    def _layout(self, paragraph: str, tag: str) -> tuple:
+        metrics, spacing = self.body, 0
+        if tag:
+            settings = self.tags[tag]
+            metrics = self.metrics(settings['font'])
+            spacing = int(settings.get('spacing1', 0)) + int(settings.get('spacing3', 0))
+
+        lines = metrics.count_lines(paragraph, self.width)
+        return lines, int(metrics.linespace * self.spacing), spacing, tag
+
+    def steps(self):
+        """ Generator that lays out dirty paragraphs block by block and then
+            counts the pages of the stale blocks, the result is stored in pages """
+        if self.body is None:
+            return
+
+        while True:
+            line = self.dirty.find(1) + 1
+            if line:
+                self._layout_lines(line)
+            else:
+                block = self.stale.find(1)
+                if block < 0:
+                    break
+                self._count_block(block)
+            yield
+
+        self.pages = 1 + sum(breaks for _, breaks, _ in self.blocks)
+
+    def _layout_lines(self, line: int) -> None:
+        last = min(line + self.FETCH_LINES, len(self.paragraphs) + 1)
+        block = self.text.get(f'{line}.0', f'{last - 1}.0 lineend').split('\n')
+        for i, paragraph in enumerate(block, line):
+            self.paragraphs[i - 1] = self._layout(paragraph, self.styles[i - 1])
+            self.dirty[i - 1] = 0
+            self.stale[(i - 1) // self.PAGE_BLOCK] = 1
+
+    def _count_block(self, block: int) -> None:
+        """ Count the page breaks in a block, it starts where the block
+            before ended. The next block is stale if it started elsewhere """
+        y = self.blocks[block - 1][2] if block else 0
+        start, breaks = y, 0
+        first = block * self.PAGE_BLOCK
+        for lines, line_height, spacing, _ in self.paragraphs[first:first + self.PAGE_BLOCK]:
+            y += spacing
+            line_height = min(line_height, self.height)
+            free = (self.height - y) // line_height
+            if lines <= free:
+                y += lines * line_height
+                continue
+
+            # continue on the following pages
+            lines -= max(free, 0)
+            per_page = self.height // line_height
+            breaks += 1 + (lines - 1) // per_page
+            y = ((lines - 1) % per_page + 1) * line_height
+
+        self.blocks[block] = start, breaks, y
+        self.stale[block] = 0
+        following = self.blocks[block + 1] if block + 1 < len(self.blocks) else None
+        if following and following[0] != y:
+            self.stale[block + 1] = 1
@@ -0,0 +1,209 @@
+import re, time, multiprocessing
+
+from lib.tokenizer import RegexLexer, LexerAborted, lex_block
+
+#============================================================================
+# worker process
+#============================================================================
+class ProbedLexer(RegexLexer):
+    """ RegexLexer that publishes which tag it is evaluating in shared
+        memory and measures the time spent in the expressions of every tag """
+    def __init__(self, patterns: dict, regions: dict, current) -> None:
+        super().__init__(patterns, regions)
+        self.current = current
+        self.timings = [0.0] * len(self.tags)
+
+        self._index = -1
+        self._start = 0.0
+
+    def probe(self, index: int) -> None:
+        now = time.perf_counter()
+        if self._index >= 0:
+            self.timings[self._index] += now - self._start
+        self._index, self._start = index, now
+        self.current.value = index
+
+def serve(conn, current, patterns: dict, regions: dict) -> None:
+    """ Main function of the worker process, lexes the blocks it receives """
+    lexer = ProbedLexer(patterns, regions, current)
+    conn.send(('ready',))
+
+    while True:
+        try:
+            number, block = conn.recv()
+        except EOFError:
+            return
+
+        result = lex_block(lexer, *block)
+        lexer.probe(-1)
+        conn.send(('done', number, result, lexer.timings))
+        lexer.timings = [0.0] * len(lexer.tags)
+
+#============================================================================
+# pattern worker
+#============================================================================
+class PatternWorker():
+    """ Evaluates user patterns in a separate process, so a pattern that
+        backtracks forever can not freeze the editor. A block that takes
+        longer than the budget kills the process and the pattern it was
+        stuck in is disabled. The time spent in every pattern is recorded. """
+    # seconds the process may take to start
+    STARTUP = 10.0
+
+    def __init__(self, on_disable=None, budget: float = 0.5) -> None:
+        """
+        :param on_disable: called with (tag, reason) after a pattern was
+                           disabled, tag is None if the worker failed
+        :param budget: seconds a block of lines may take
+        """
+        self.on_disable = on_disable
+        self.budget = budget
+
+        self.patterns = {}
+        self.regions = {}
+        self.disabled = {}      # tag -> reason
+        self.timings = {}       # tag -> seconds
+        self.lines = 0          # lines lexed by the worker
+        self.failed = False
+        self.lexer = RegexLexer({})
+
+        self._process = None
+        self._conn = None
+        self._current = None
+        self._ready = False
+        self._deadline = None
+        self._lines = 0
+        self._block = 0         # number of the block in flight
+
+    def configure(self, patterns: dict, regions: dict) -> RegexLexer:
+        """ Set the patterns, invalid ones are disabled right away and
+            patterns that were disabled stay disabled until they change.
+            Returns the lexer without the disabled patterns """
+        if patterns == self.patterns and regions == self.regions:
+            return self.lexer
+
+        # keep the verdicts on the patterns that did not change
+        before = self.patterns | self.regions
+        after = patterns | regions
+        self.disabled = {tag: reason for tag, reason in self.disabled.items()
+                         if tag in after and after[tag] == before.get(tag)}
+
+        self.patterns, self.regions = patterns, regions
+        self.timings.clear()
+        self.lines = 0
+        self.failed = False
+
+        expressions = [(tag, p) for tag, p in patterns.items()]
+        expressions += [(tag, p) for tag, region in regions.items() for p in region]
+        for tag, pattern in expressions:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                self.disabled[tag] = f"invalid pattern: {e}"
+
+        for tag, region in regions.items():
+            if len(region) != 2:
+                self.disabled[tag] = "a region needs a start and an end pattern on two lines"
+
+        self._rebuild()
+        return self.lexer
+
+    def expressions(self) -> tuple:
+        """ Returns the patterns and regions that are not disabled """
+        return self._enabled(self.patterns), self._enabled(self.regions)
+
+    def stats(self) -> list:
+        """ Returns (tag, total ms, microseconds per line, status) of every tag """
+        rows = []
+        for tag in list(self.patterns) + list(self.regions):
+            seconds = self.timings.get(tag, 0.0)
+            per_line = seconds * 1e6 / self.lines if self.lines else 0.0
+            rows.append((tag, seconds * 1000, per_line, self.disabled.get(tag, 'ok')))
+        return rows
+
+    def submit(self, block: tuple) -> None:
+        """ Start lexing a block, see lex_block for its arguments.
+            Only the result of the last submitted block is returned """
+        self._block += 1
+        try:
+            if self._process is None:
+                self._start()
+            self._conn.send((self._block, block))
+        except OSError:
+            self._abort("the pattern worker stopped")
+
+        self._lines = len(block[2])
+        self._deadline = time.perf_counter() + (self.budget if self._ready else self.STARTUP)
+
+    def result(self) -> tuple:
+        """ Returns the result of lex_block or None while the worker is busy.
+            Raises LexerAborted if the worker gave up on the block """
+        try:
+            while self._conn.poll(0.001):
+                message = self._conn.recv()
+                if message[0] == 'ready':
+                    self._ready = True
+                    self._deadline = time.perf_counter() + self.budget
+                    continue
+
+                _, number, result, timings = message
+                for tag, seconds in zip(self.lexer.tags, timings):
+                    self.timings[tag] = self.timings.get(tag, 0.0) + seconds
+
+                # the reply to a block that was given up on
+                if number != self._block:
+                    continue
+                self.lines += self._lines
+                return result
+        except (EOFError, OSError):
+            self._abort("the pattern worker stopped")
+
+        if time.perf_counter() > self._deadline:
+            self._abort(f"took longer than {self.budget * 1000:.0f} ms")
+        return None
+
+    def running(self) -> bool:
+        return self._process is not None
+
+    def close(self) -> None:
+        if self._process:
+            self._process.kill()
+            self._process.join()
+            self._conn.close()
+        self._process = None
+        self._conn = None
+        self._ready = False
+
+    def _start(self) -> None:
+        # spawn, forking would copy the Tk connection of the editor
+        context = multiprocessing.get_context('spawn')
+        self._conn, child = context.Pipe()
+        self._current = context.Value('i', -1, lock=False)
+        args = (child, self._current) + self.expressions()
+        self._process = context.Process(target=serve, args=args, daemon=True)
+        self._process.start()
+        child.close()
+
+    def _enabled(self, expressions: dict) -> dict:
+        return {tag: e for tag, e in expressions.items() if tag not in self.disabled}
+
+    def _rebuild(self) -> None:
+        self.close()
+        self.lexer = RegexLexer(*self.expressions())
+
+    def _abort(self, reason: str) -> None:
+        """ Disable the pattern the worker is stuck in and start over """
+        index = self._current.value if self._ready else -1
+        tag = self.lexer.tags[index] if 0 <= index < len(self.lexer.tags) else None
+
+        if tag is None:
+            # nothing to blame, lex on the main thread from now on
+            self.failed = True
+            self.close()
+        else:
+            self.disabled[tag] = reason
+            self._rebuild()
+
+        if self.on_disable:
+            self.on_disable(tag, reason)
+        raise LexerAborted(reason)
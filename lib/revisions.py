@@ -0,0 +1,146 @@
+import os, json, time, zlib, hashlib, difflib
+
+STORE_DIR = os.path.join('.capricorn', 'revisions')
+
+# chunk boundaries are chosen by content, so an edit only changes the chunks around it
+MIN_CHUNK = 2 * 1024
+MAX_CHUNK = 64 * 1024
+BOUNDARY_MASK = 0x1f
+
+def split_chunks(data: bytes) -> list:
+    """ Split data into content defined chunks.
+        A chunk ends after a line whose checksum matches the boundary mask once
+        it reached MIN_CHUNK bytes, or when it reaches MAX_CHUNK bytes. """
+    chunks = []
+    start = pos = 0
+    while pos < len(data):
+        end = data.find(b'\n', pos, start + MAX_CHUNK)
+        overlong = end < 0
+        if overlong:
+            # cut overlong lines, but never inside a utf-8 sequence
+            end = min(start + MAX_CHUNK, len(data))
+            while end > pos + 1 and end < len(data) and data[end] & 0xc0 == 0x80:
+                end -= 1
+        else:
+            end += 1
+
+        line = data[pos:end]
+        pos = end
+        if overlong or (pos - start >= MIN_CHUNK and not zlib.crc32(line) & BOUNDARY_MASK):
+            chunks.append(data[start:pos])
+            start = pos
+
+    if start < len(data):
+        chunks.append(data[start:])
+    return chunks
+
+#============================================================================
+# revision store
+#============================================================================
+class RevisionStore():
+    """ Content addressed, deduplicated snapshots of the files in a folder.
+        Chunks are shared between all revisions of all files in the folder. """
+    def __init__(self, filename: str) -> None:
+        folder, name = os.path.split(os.path.abspath(filename))
+
+        self.root = os.path.join(folder, STORE_DIR)
+        self.objects = os.path.join(self.root, 'objects')
+        self.manifest = os.path.join(self.root, name + '.jsonl')
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects, digest[:2], digest[2:])
+
+    def _write_chunk(self, chunk: bytes) -> tuple:
+        """ Store a chunk unless it already exists, returns (digest, bytes written) """
+        digest = hashlib.sha256(chunk).hexdigest()
+        path = self._object_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = zlib.compress(chunk)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        return digest, len(data)
+
+    def _read_chunk(self, digest: str) -> bytes:
+        with open(self._object_path(digest), 'rb') as f:
+            return zlib.decompress(f.read())
+
+    def commit(self, text: str) -> dict:
+        """ Store text as a new revision, returns the revision entry """
+        data = text.encode('utf-8')
+        chunks = [self._write_chunk(c) for c in split_chunks(data)]
+
+        revision = {
+            'time': time.time(),
+            'size': len(data),
+            'written': sum(written for _, written in chunks),
+            'chunks': [digest for digest, _ in chunks]
+        }
+
+        # skip saves without changes
+        revisions = self.revisions()
+        if revisions and revisions[-1]['chunks'] == revision['chunks']:
+            return revisions[-1]
+
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.manifest, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(revision) + '\n')
+        return revision
+
+    def revisions(self) -> list:
+        """ Returns all revisions of the file, oldest first """
+        try:
+            with open(self.manifest, 'r', encoding='utf-8') as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def read(self, revision: dict) -> str:
+        data = b''.join(self._read_chunk(d) for d in revision['chunks'])
+        return data.decode('utf-8')
+
+    def diff(self, revision: dict, text: str, name: str = 'current') -> list:
+        """ Returns a unified diff between a revision and text.
+            Chunks both sides share are skipped without being read. """
+        old = revision['chunks']
+        new = split_chunks(text.encode('utf-8'))
+        digests = [hashlib.sha256(c).hexdigest() for c in new]
+
+        # strip the common chunks at the start and at the end
+        head = 0
+        while head < min(len(old), len(new)) and old[head] == digests[head]:
+            head += 1
+        tail = 0
+        while tail < min(len(old), len(new)) - head and old[-tail - 1] == digests[-tail - 1]:
+            tail += 1
+
+        old_text = b''.join(self._read_chunk(d) for d in old[head:len(old) - tail])
+        new_text = b''.join(new[head:len(new) - tail])
+
+        # line numbers of the compared region
+        offset = sum(c.count(b'\n') for c in new[:head])
+
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(revision['time']))
+        lines = difflib.unified_diff(
+            old_text.decode('utf-8').splitlines(keepends=True),
+            new_text.decode('utf-8').splitlines(keepends=True),
+            fromfile=stamp, tofile=name)
+        return list(shift_hunks(lines, offset))
+
+
+def shift_hunks(lines, offset: int):
+    """ Shift the line numbers in unified diff hunk headers by offset """
+    for line in lines:
+        if offset and line.startswith('@@'):
+            old, new = line.split(' ')[1:3]
+            line = f"@@ {shift_range(old, offset)} {shift_range(new, offset)} @@\n"
+        yield line
+
+
+def shift_range(hunk_range: str, offset: int) -> str:
+    sign, numbers = hunk_range[0], hunk_range[1:].split(',')
+    numbers[0] = str(int(numbers[0]) + offset)
+    return sign + ','.join(numbers)
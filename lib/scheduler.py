@@ -0,0 +1,102 @@
+import time, types, itertools
+
+PRIORITY_HIGH = 0       # e.g. cursor position
+PRIORITY_NORMAL = 1     # e.g. highlighting of edited lines
+PRIORITY_LOW = 2        # e.g. full document analysis
+
+#============================================================================
+# scheduler
+#============================================================================
+class Task():
+    __slots__ = ('key', 'priority', 'order', 'func', 'steps')
+
+    def __init__(self, key, priority: int, order: int, func) -> None:
+        self.key = key
+        self.priority = priority
+        self.order = order
+        self.func = func
+        self.steps = None   # generator once the task started
+
+
+class Scheduler():
+    """ Runs prioritized tasks in the idle time of the Tk main loop.
+        A task is a function; if it returns a generator the task is resumed
+        at every yield, so long tasks are spread over several frames.
+        Every frame runs tasks until the frame budget is used up. """
+    def __init__(self, widget, budget: float = 8.0) -> None:
+        """
+        :param budget: milliseconds per frame tasks may use
+        """
+        self.widget = widget
+        self.budget = budget
+
+        self.tasks = {}
+        self._order = itertools.count()
+        self._job = None
+
+        # metrics
+        self.frames = 0
+        self.overruns = 0       # frames that took longer than the budget
+        self.max_frame = 0.0    # longest frame in milliseconds
+
+    def schedule(self, key, func, priority: int = PRIORITY_NORMAL) -> None:
+        """ Schedule func under key. A task already scheduled with the same
+            key is replaced, so repeated requests only run once. """
+        self.tasks[key] = Task(key, priority, next(self._order), func)
+        if self._job is None:
+            self._job = self.widget.after_idle(self._run)
+
+    def cancel(self, key) -> None:
+        self.tasks.pop(key, None)
+
+    def queue_depth(self) -> int:
+        return len(self.tasks)
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.queue_depth(),
+            'frames': self.frames,
+            'overruns': self.overruns,
+            'max_frame_ms': round(self.max_frame, 3),
+        }
+
+    def _step(self, task: Task) -> bool:
+        """ Run one step of a task, returns True when the task is finished """
+        if task.steps is None:
+            result = task.func()
+            if not isinstance(result, types.GeneratorType):
+                return True
+            task.steps = result
+
+        try:
+            next(task.steps)
+        except StopIteration:
+            return True
+        return False
+
+    def _run(self) -> None:
+        self._job = None
+
+        start = time.perf_counter()
+        deadline = start + self.budget / 1000
+        try:
+            while self.tasks and time.perf_counter() < deadline:
+                task = min(self.tasks.values(), key=lambda t: (t.priority, t.order))
+
+                # a failing task is dropped
+                finished = True
+                try:
+                    finished = self._step(task)
+                finally:
+                    if finished and self.tasks.get(task.key) is task:
+                        del self.tasks[task.key]
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.frames += 1
+            self.max_frame = max(self.max_frame, elapsed)
+            if elapsed > self.budget:
+                self.overruns += 1
+
+            # give the event loop a chance before the next frame
+            if self.tasks:
+                self._job = self.widget.after(1, self._run)
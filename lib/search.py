@@ -0,0 +1,162 @@
+import os, sqlite3, threading
+
+from contextlib import contextmanager
+
+from lib.textfile import EXTENSIONS, READ_ERRORS, open_text
+
+INDEX_DIR = '.capricorn'
+INDEX_FILE = 'index.sqlite'
+
+# lines per indexed block, hits point to the first line of their block
+BLOCK_LINES = 20
+
+# bounds of the folder walk, so searching from a folder like home stays cheap
+MAX_DEPTH = 4
+MAX_FILES = 5000
+MAX_FILE_SIZE = 16 << 20
+EXCLUDED_DIRS = {'node_modules', '__pycache__', 'venv', 'build', 'dist'}
+
+# the rowid of a block is (file id << BLOCK_BITS) + block number, so the
+# blocks of a file can be deleted as one rowid range
+BLOCK_BITS = 24
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id    INTEGER PRIMARY KEY,
+    path  TEXT UNIQUE NOT NULL,
+    mtime INTEGER NOT NULL,
+    size  INTEGER NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS blocks USING fts5(content);
+"""
+
+def fts_query(query: str) -> str:
+    """ Turn user input into an fts5 query matching all words,
+        the last word also matches as a prefix """
+    terms = ['"%s"' % t.replace('"', '""') for t in query.split()]
+    if terms:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+#============================================================================
+# project index
+#============================================================================
+class ProjectIndex():
+    """ Full text index over the text files of a folder using sqlite fts5.
+        Files are only re-indexed if their mtime or size changed. """
+    def __init__(self, folder: str, extensions: tuple = EXTENSIONS) -> None:
+        self.folder = os.path.abspath(folder)
+        self.extensions = extensions
+
+        self.path = os.path.join(self.folder, INDEX_DIR, INDEX_FILE)
+        self._lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        """ Returns a new connection, use one per thread """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        db = sqlite3.connect(self.path)
+        # let searches read while the index is being updated
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript(SCHEMA)
+        return db
+
+    @contextmanager
+    def transaction(self):
+        db = self.connect()
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def scan(self) -> dict:
+        """ Returns path -> (mtime, size) of the files to index, at most
+            MAX_FILES files up to MAX_DEPTH folders deep """
+        files = {}
+        for root, dirs, names in os.walk(self.folder):
+            depth = 0 if root == self.folder else os.path.relpath(root, self.folder).count(os.sep) + 1
+            dirs[:] = [d for d in dirs if not d.startswith('.') and d not in EXCLUDED_DIRS] \
+                if depth < MAX_DEPTH else []
+
+            for name in names:
+                if not name.endswith(self.extensions):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if st.st_size <= MAX_FILE_SIZE:
+                    files[os.path.relpath(path, self.folder)] = (st.st_mtime_ns, st.st_size)
+                if len(files) >= MAX_FILES:
+                    return files
+        return files
+
+    def update(self) -> int:
+        """ Bring the index up to date, returns the number of indexed files """
+        with self._lock, self.transaction() as db:
+            indexed = {p: (m, s) for p, m, s in db.execute('SELECT path, mtime, size FROM files')}
+            files = self.scan()
+
+            for path in indexed.keys() - files.keys():
+                self._remove(db, path)
+
+            changed = [p for p, stat in files.items() if indexed.get(p) != stat]
+            for path in changed:
+                self._index(db, path, files[path])
+        return len(changed)
+
+    def refresh(self, filename: str) -> None:
+        """ Re-index a single file, e.g. after saving it """
+        path = os.path.relpath(os.path.abspath(filename), self.folder)
+        if path.startswith('..') or not path.endswith(self.extensions):
+            return
+
+        st = os.stat(filename)
+        if st.st_size > MAX_FILE_SIZE:
+            return
+        with self._lock, self.transaction() as db:
+            self._index(db, path, (st.st_mtime_ns, st.st_size))
+
+    def _remove(self, db: sqlite3.Connection, path: str) -> None:
+        row = db.execute('SELECT id FROM files WHERE path = ?', (path,)).fetchone()
+        if row:
+            first = row[0] << BLOCK_BITS
+            db.execute('DELETE FROM blocks WHERE rowid BETWEEN ? AND ?', (first, first + (1 << BLOCK_BITS) - 1))
+            db.execute('DELETE FROM files WHERE id = ?', row)
+
+    def _index(self, db: sqlite3.Connection, path: str, stat: tuple) -> None:
+        self._remove(db, path)
+        try:
+            with open_text(os.path.join(self.folder, path), 'r', encoding='utf-8', errors='replace') as f:
+                lines = f.read().split('\n')
+        except READ_ERRORS:
+            return
+
+        cursor = db.execute('INSERT INTO files (path, mtime, size) VALUES (?, ?, ?)', (path,) + stat)
+        first = cursor.lastrowid << BLOCK_BITS
+
+        blocks = ((first + n, '\n'.join(lines[i:i + BLOCK_LINES]))
+                  for n, i in enumerate(range(0, len(lines), BLOCK_LINES)))
+        db.executemany('INSERT INTO blocks (rowid, content) VALUES (?, ?)', blocks)
+
+    def search(self, query: str, limit: int = 100) -> list:
+        """ Returns (path, line, snippet) of the best matching blocks.
+            line is the first line of the block, the line of the first
+            match is found when the hit is opened. """
+        query = fts_query(query)
+        if not query:
+            return []
+
+        with self.transaction() as db:
+            try:
+                rows = db.execute(
+                    "SELECT files.path, blocks.rowid, snippet(blocks, 0, '[', ']', '...', 12) "
+                    "FROM blocks JOIN files ON files.id = blocks.rowid >> ? "
+                    "WHERE blocks MATCH ? ORDER BY rank LIMIT ?", (BLOCK_BITS, query, limit)).fetchall()
+            except sqlite3.OperationalError:
+                return []
+
+        mask = (1 << BLOCK_BITS) - 1
+        return [(os.path.join(self.folder, path), (rowid & mask) * BLOCK_LINES + 1, snippet.replace('\n', ' '))
+                for path, rowid, snippet in rows]
@@ -0,0 +1,66 @@
+import os, json, hashlib
+
+# number of files whose state is remembered
+MAX_FILES = 32
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def config_hash(*sections: dict) -> str:
+    """ Hash of config sections, e.g. to detect changed patterns """
+    return content_hash(json.dumps(sections, sort_keys=True))
+
+def run_length_encode(values: list) -> list:
+    runs = []
+    for value in values:
+        if runs and runs[-1][0] == value:
+            runs[-1][1] += 1
+        else:
+            runs.append([value, 1])
+    return runs
+
+def run_length_decode(runs: list) -> list:
+    values = []
+    for value, count in runs:
+        values.extend([value] * count)
+    return values
+
+#============================================================================
+# session
+#============================================================================
+class Session():
+    """ State of the recently open files, stored as json. The file to open
+        on startup is the last_file of the config """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.files = {}     # path -> state, least recently used first
+
+    def load(self) -> None:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        self.files = data.get('files', {})
+
+    def save(self) -> None:
+        data = {
+            'files': self.files
+        }
+
+        # write to a temporary file first, a crash must not lose the session
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(self.path + '.tmp', self.path)
+
+    def get(self, filename: str) -> dict:
+        return self.files.get(os.path.abspath(filename))
+
+    def update(self, filename: str, state: dict) -> None:
+        filename = os.path.abspath(filename)
+
+        self.files.pop(filename, None)
+        self.files[filename] = state
+        while len(self.files) > MAX_FILES:
+            del self.files[next(iter(self.files))]
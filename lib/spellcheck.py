@@ -0,0 +1,183 @@
+import re, os, sys, queue, threading
+
+from array import array
+
+WORD_PATTERN = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)*")
+
+DEFAULT_DICTIONARIES = [
+    '/usr/share/dict/words',
+    '/usr/dict/words',
+]
+
+#============================================================================
+# word list
+#============================================================================
+class WordList():
+    """ Sorted word list stored as one string, searched by bisection """
+    def __init__(self, words) -> None:
+        words = sorted({w.strip().lower() for w in words} - {''})
+
+        self.data = '\n'.join(words) + '\n'
+        self.offsets = array('L', [0])
+        for word in words:
+            self.offsets.append(self.offsets[-1] + len(word) + 1)
+
+    @classmethod
+    def load(cls, filename: str):
+        with open(filename, 'r', encoding='utf-8', errors='ignore') as f:
+            return cls(f)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def memory(self) -> int:
+        return sys.getsizeof(self.data) + len(self.offsets) * self.offsets.itemsize
+
+    def __getitem__(self, i: int) -> str:
+        return self.data[self.offsets[i]:self.offsets[i + 1] - 1]
+
+    def __contains__(self, word: str) -> bool:
+        word = word.lower()
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid] < word:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo < len(self) and self[lo] == word
+
+
+def find_dictionary(filename: str) -> str:
+    """ Returns the configured word list or the first system word list found """
+    for path in [filename] + DEFAULT_DICTIONARIES:
+        if path and os.path.isfile(path):
+            return path
+    return None
+
+#============================================================================
+# spell checker
+#============================================================================
+class SpellChecker():
+    """ Checks edited and newly visible lines of a text widget on a worker thread """
+    def __init__(self, text, tag: str = 'misspelled', poll: int = 50) -> None:
+        self.text = text
+        self.tag = tag
+        self.poll = poll
+
+        self.words = None
+        self.checked = bytearray(1)     # one flag per line, index 0 is line 1
+
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._pending = 0
+        self._scheduled = None
+
+        threading.Thread(target=self._work, daemon=True).start()
+
+        text.add_change_listener(self.on_change)
+
+    def load(self, filename: str) -> None:
+        """ Load a word list in the background, an empty filename disables checking """
+        self.words = None
+        self.text.tag_remove(self.tag, '1.0', 'end')
+        self.checked = bytearray(len(self.checked))
+
+        path = find_dictionary(filename)
+        if path:
+            self._submit(('load', path))
+
+    def on_change(self, change) -> None:
+        # mark lines touched by the edit as unchecked
+        first = change.line - 1
+        self.checked[first:first + change.old_line_count] = bytes(change.new_line_count)
+        self.schedule()
+
+    def schedule(self) -> None:
+        """ Check unchecked visible lines once the widget is idle """
+        if self._scheduled is None:
+            self._scheduled = self.text.after_idle(self.check_visible)
+
+    def visible_lines(self) -> range:
+        first = int(self.text.index('@0,0').split('.')[0])
+        last = int(self.text.index(f'@0,{self.text.winfo_height()}').split('.')[0])
+        return range(first, last + 1)
+
+    def check_visible(self) -> None:
+        self._scheduled = None
+        if self.words is None:
+            return
+
+        lines = [ln for ln in self.visible_lines() if not self.checked[ln - 1]]
+        if not lines:
+            return
+
+        # fetch the whole span at once instead of line by line
+        content = self.text.get(f'{lines[0]}.0', f'{lines[-1]}.0 lineend').split('\n')
+        job = [(ln, content[ln - lines[0]]) for ln in lines]
+        for ln in lines:
+            self.checked[ln - 1] = 1
+
+        self._submit(('check', job))
+
+    def _submit(self, job) -> None:
+        self._jobs.put(job)
+        if not self._pending:
+            self.text.after(self.poll, self._collect)
+        self._pending += 1
+
+    def _work(self) -> None:
+        while True:
+            kind, arg = self._jobs.get()
+            if kind == 'load':
+                try:
+                    self._results.put(('load', WordList.load(arg)))
+                except OSError:
+                    self._results.put(('load', None))
+                continue
+
+            words = self.words
+            if words is None:
+                self._results.put(('check', []))
+                continue
+
+            result = []
+            for ln, line in arg:
+                spans = [m.span() for m in WORD_PATTERN.finditer(line)
+                         if len(m.group()) > 1 and m.group() not in words]
+                result.append((ln, line, spans))
+            self._results.put(('check', result))
+
+    def _collect(self) -> None:
+        """ Apply finished results on the main thread """
+        while not self._results.empty():
+            kind, result = self._results.get()
+            self._pending -= 1
+
+            if kind == 'load':
+                self.words = result
+                self.schedule()
+            else:
+                self._apply(result)
+
+        if self._pending:
+            self.text.after(self.poll, self._collect)
+
+    def _apply(self, result: list) -> None:
+        if not result:
+            return
+
+        first = min(ln for ln, _, _ in result)
+        last = max(ln for ln, _, _ in result)
+        lines = self.text.get(f'{first}.0', f'{last}.0 lineend').split('\n')
+
+        clear, misspelled = [], []
+        for ln, line, spans in result:
+            # drop results for lines that changed in the meantime
+            if ln - first >= len(lines) or lines[ln - first] != line:
+                continue
+
+            clear.append((ln, ln + 1))
+            misspelled.extend((ln, start, end) for start, end in spans)
+
+        self.text.tag_lines([self.tag], clear, {self.tag: misspelled})
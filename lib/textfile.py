@@ -0,0 +1,39 @@
+import io, gzip, lzma
+
+# compressed formats by extension, (de)compressed while streaming
+CODECS = {
+    '.gz': lambda raw, mode: gzip.GzipFile(fileobj=raw, mode=mode),
+    '.xz': lambda raw, mode: lzma.LZMAFile(raw, mode=mode),
+}
+
+OPENERS = {
+    '.gz': gzip.open,
+    '.xz': lzma.open,
+}
+
+EXTENSIONS = ('.txt', '.txt.gz', '.txt.xz')
+
+# errors of reading a damaged or truncated file
+READ_ERRORS = (OSError, EOFError, lzma.LZMAError)
+
+def codec(filename: str) -> str:
+    """ Returns the extension of the compression of a file or None """
+    for ext in CODECS:
+        if filename.endswith(ext):
+            return ext
+    return None
+
+def text_stream(raw, filename: str, mode: str = 'r') -> io.TextIOWrapper:
+    """ Text stream on top of a binary file that was opened by the caller,
+        so the caller can follow the position in the (compressed) file.
+        Closing the stream does not close a compressed raw file. """
+    ext = codec(filename)
+    stream = CODECS[ext](raw, mode + 'b') if ext else raw
+    return io.TextIOWrapper(stream)
+
+def open_text(filename: str, mode: str = 'r', **kw):
+    """ Like open, but reads and writes compressed files transparently """
+    ext = codec(filename)
+    if ext:
+        return OPENERS[ext](filename, mode + 't', **kw)
+    return open(filename, mode, **kw)
@@ -0,0 +1,280 @@
+import re
+
+from collections import defaultdict
+
+from lib.session import run_length_encode, run_length_decode
+
+# checkpoint of a line that has not been lexed yet, never equal to a state
+UNKNOWN = object()
+
+class LexerAborted(Exception):
+    """ Raised by a lexer worker that gave up on a block, e.g. because it
+        disabled a pattern. Its lexer changed and the text is lexed again. """
+
+def lex_block(lexer, first: int, state, lines: list, stops: dict) -> tuple:
+    """ Lex lines from line first on, starting in state. Lexing stops after
+        a line whose end state equals its entry in stops.
+        Returns ({tag: [(line, start, end), ...]}, end states, stopped) """
+    tokens = defaultdict(list)
+    states = []
+    for line, text in enumerate(lines, first):
+        line_tokens, state = lexer.lex_line(text, state)
+        for tag, start, end in line_tokens:
+            tokens[tag].append((line, start, end))
+
+        states.append(state)
+        if line in stops and stops[line] == state:
+            return dict(tokens), states, True
+    return dict(tokens), states, False
+
+#============================================================================
+# lexers
+#============================================================================
+class Lexer():
+    """ Interface of the lexers the Tokenizer can drive. A lexer turns one line
+        and the state at its start into tokens and the state at its end.
+        States must be comparable, None is the state at the start of the text. """
+    tags = ()
+
+    def lex_line(self, line: str, state) -> tuple:
+        """ Returns ([(tag, start, end), ...], state at the end of the line) """
+        return [], state
+
+
+class RegexLexer(Lexer):
+    """ Lexer for single line patterns and multi-line regions.
+        A region is tagged from a match of its start to a match of its end
+        pattern and may span any number of lines. """
+    def __init__(self, patterns: dict, regions: dict = None) -> None:
+        """
+        :param patterns: tag -> pattern, matched within a line
+        :param regions: tag -> (start pattern, end pattern)
+        """
+        self.patterns = [(tag, re.compile(p)) for tag, p in patterns.items()]
+        self.regions = {tag: (re.compile(start), re.compile(end))
+                        for tag, (start, end) in (regions or {}).items()}
+
+        self.tags = [tag for tag, _ in self.patterns] + list(self.regions)
+        self._region_index = {tag: i for i, tag in enumerate(self.tags) if tag in self.regions}
+
+    def probe(self, index: int) -> None:
+        """ Called before the expressions of tags[index] are evaluated """
+
+    def _match_patterns(self, line: str, pos: int, endpos: int, tokens: list) -> None:
+        for i, (tag, pattern) in enumerate(self.patterns):
+            self.probe(i)
+            for match in pattern.finditer(line, pos, endpos):
+                if match.end() > match.start():
+                    tokens.append((tag, match.start(), match.end()))
+
+    def _next_region(self, line: str, pos: int) -> tuple:
+        """ Returns (tag, match) of the earliest region start from pos on """
+        best = None, None
+        for tag, (start, _) in self.regions.items():
+            self.probe(self._region_index[tag])
+            match = start.search(line, pos)
+            # a start that matches nothing would never move on
+            while match and match.start() == match.end():
+                match = start.search(line, match.end() + 1) if match.end() < len(line) else None
+            if match and (best[1] is None or match.start() < best[1].start()):
+                best = tag, match
+        return best
+
+    def lex_line(self, line: str, state) -> tuple:
+        tokens = []
+        pos = start = 0
+        while True:
+            if state is not None:
+                # inside a region, look for its end
+                self.probe(self._region_index[state])
+                match = self.regions[state][1].search(line, pos)
+                if not match:
+                    tokens.append((state, start, len(line)))
+                    return tokens, state
+
+                tokens.append((state, start, match.end()))
+                pos, state = match.end(), None
+
+            tag, match = self._next_region(line, pos)
+            if not match:
+                self._match_patterns(line, pos, len(line), tokens)
+                return tokens, None
+
+            self._match_patterns(line, pos, match.start(), tokens)
+            state, start = tag, match.start()
+            pos = max(match.end(), pos + 1)
+
+
+#============================================================================
+# tokenizer
+#============================================================================
+class Tokenizer():
+    """ Incrementally tags a text widget with a Lexer.
+        The lexer state at the end of every line is kept as a checkpoint, so
+        after an edit lexing starts at the first dirty line and stops as soon
+        as a line ends in the same state as before.
+        With a worker, blocks are lexed by the worker while the steps wait. """
+    FETCH_LINES = 256
+
+    def __init__(self, text, lexer: Lexer = None) -> None:
+        self.text = text
+        self.lexer = lexer or Lexer()
+        self.worker = None
+        self.pending = None             # (first line, change count) of the block the worker lexes
+
+        self.states = [None]            # lexer state at the end of each line
+        self.dirty = bytearray(b'\1')   # lines that changed since the last update
+        self._listeners = []
+
+        text.add_change_listener(self.on_change)
+
+    def add_token_listener(self, callback) -> None:
+        """ callback(first, last, tokens) is called after the lines [first, last)
+            were tagged again, tokens is None if the tags were restored """
+        self._listeners.append(callback)
+
+    def set_lexer(self, lexer: Lexer, worker=None) -> None:
+        """ Replace the lexer and re-lex the whole text on the next update.
+            worker lexes blocks for the lexer, see PatternWorker """
+        for tag in self.lexer.tags:
+            self.text.tag_remove(tag, '1.0', 'end')
+
+        self.lexer = lexer
+        self.worker = worker
+        self.pending = None
+        self.dirty = bytearray(b'\1' * len(self.states))
+
+    def on_change(self, change) -> None:
+        first = change.line - 1
+        last = first + change.old_line_count
+
+        # the last changed line keeps the old checkpoint, so lexing can stop
+        # right after it if its end state did not change
+        states = [UNKNOWN] * (change.new_line_count - 1) + [self.states[last - 1]]
+        self.states[first:last] = states
+        self.dirty[first:last] = b'\1' * change.new_line_count
+
+    def update(self) -> None:
+        """ Re-lex all dirty lines and lines whose start state changed """
+        for _ in self.steps():
+            pass
+
+    def steps(self):
+        """ Like update, but yields after every block of lines.
+            Edits between the steps are picked up by the next step.
+            The worker lexes one block at a time, a block submitted by
+            steps that were abandoned is waited for first. """
+        while True:
+            if self.pending is None:
+                line = self.dirty.find(1) + 1
+                if not line:
+                    return
+
+                block = self._prepare(line)
+                if not self.worker:
+                    self._finish(line, *lex_block(self.lexer, *block))
+                    yield
+                    continue
+
+                self.pending = line, self.text.change_count
+                try:
+                    self.worker.submit(block)
+                except LexerAborted:
+                    self._restart()
+                    continue
+
+            try:
+                while (result := self.worker.result()) is None:
+                    yield
+            except LexerAborted:
+                self._restart()
+                continue
+
+            first, change_count = self.pending
+            self.pending = None
+
+            # drop the result if the text was edited while the worker was busy
+            if change_count == self.text.change_count:
+                self._finish(first, *result)
+            yield
+
+    def _restart(self) -> None:
+        """ The worker changed its lexer, start over with it """
+        self.set_lexer(self.worker.lexer, None if self.worker.failed else self.worker)
+
+    def _prepare(self, line: int) -> tuple:
+        """ Returns the arguments of lex_block for at most FETCH_LINES lines
+            from line on. Lexing may stop after a line whose next line is
+            clean and whose checkpoint did not change """
+        count = len(self.states)
+        state = self.states[line - 2] if line > 1 else None
+
+        # fetch the lines at once to save round trips to tcl
+        last = min(line + self.FETCH_LINES, count + 1)
+        lines = self.text.get(f'{line}.0', f'{last - 1}.0 lineend').split('\n')
+
+        stops = {ln: self.states[ln - 1] for ln in range(line, min(last, count))
+                 if not self.dirty[ln] and self.states[ln - 1] is not UNKNOWN}
+        return line, state, lines, stops
+
+    def _finish(self, first: int, tokens: dict, states: list, stopped: bool) -> None:
+        line = first + len(states)
+        self.states[first - 1:line - 1] = states
+        self.dirty[first - 1:line - 1] = bytes(len(states))
+
+        # continue with the next block in the next step
+        if not stopped and line <= len(self.states):
+            self.dirty[line - 1] = 1
+
+        self._apply(first, line, tokens)
+
+    def load(self, states: list, tokens: dict, dirty: list = ()) -> bool:
+        """ Take over the states and tokens of the whole text lexed elsewhere,
+            the lines in dirty are lexed again on the next update """
+        if len(states) != len(self.states):
+            return False
+
+        self.states = states
+        self.dirty = bytearray(len(states))
+        for line in dirty:
+            self.dirty[line - 1] = 1
+
+        self._apply(1, len(states) + 1, tokens)
+        return True
+
+    def export(self) -> dict:
+        """ Returns the checkpoints and tag ranges, or None while lines are
+            still to be lexed. The states of the lexer must be json
+            serializable to store the result """
+        if self.pending or self.dirty.find(1) >= 0:
+            return None
+        return {
+            'states': run_length_encode(self.states),
+            'ranges': {tag: [str(i) for i in self.text.tag_ranges(tag)] for tag in self.lexer.tags}
+        }
+
+    def restore(self, data: dict) -> bool:
+        """ Restore a result of export for the same text and lexer
+            with one tag call per tag. Returns False if it does not fit """
+        states = run_length_decode(data['states'])
+        if len(states) != len(self.states) or set(data['ranges']) != set(self.lexer.tags):
+            return False
+
+        for tag, ranges in data['ranges'].items():
+            self.text.tag_remove(tag, '1.0', 'end')
+            if ranges:
+                self.text.tag_add(tag, *ranges)
+
+        self.states = states
+        self.dirty = bytearray(len(states))
+        self._notify(1, len(states) + 1, None)
+        return True
+
+    def _apply(self, first: int, last: int, tokens: dict) -> None:
+        """ Replace the tags on the lines [first, last) """
+        self.text.tag_lines(self.lexer.tags, [(first, last)], tokens)
+        self._notify(first, last, tokens)
+
+    def _notify(self, first: int, last: int, tokens: dict) -> None:
+        for callback in self._listeners:
+            callback(first, last, tokens)
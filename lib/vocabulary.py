@@ -0,0 +1,115 @@
+import re, heapq
+
+from collections import Counter
+
+WORD_PATTERN = re.compile(r'\w+')
+
+#============================================================================
+# prefix tree
+#============================================================================
+class PrefixNode():
+    __slots__ = ('children', 'spellings', 'count')
+
+    def __init__(self) -> None:
+        self.children = {}
+        self.spellings = None   # Counter of spellings ending at this node
+        self.count = 0          # number of words in this subtree
+
+
+class PrefixTree():
+    """ Case insensitive prefix tree that counts how often each word occurs """
+    def __init__(self) -> None:
+        self.root = PrefixNode()
+
+    def add(self, word: str, count: int = 1) -> None:
+        node = self.root
+        node.count += count
+        for c in word.lower():
+            node = node.children.setdefault(c, PrefixNode())
+            node.count += count
+
+        if node.spellings is None:
+            node.spellings = Counter()
+        node.spellings[word] += count
+
+    def remove(self, word: str, count: int = 1) -> None:
+        path = [self.root]
+        for c in word.lower():
+            node = path[-1].children.get(c)
+            if node is None:
+                return
+            path.append(node)
+
+        spellings = path[-1].spellings
+        if not spellings or spellings[word] < count:
+            return
+
+        spellings[word] -= count
+        if not spellings[word]:
+            del spellings[word]
+
+        # update counts and prune empty branches
+        for node in path:
+            node.count -= count
+        for parent, c in zip(reversed(path[:-1]), reversed(word.lower())):
+            if parent.children[c].count:
+                break
+            del parent.children[c]
+
+    def clear(self) -> None:
+        self.root = PrefixNode()
+
+    def find(self, prefix: str) -> PrefixNode:
+        node = self.root
+        for c in prefix.lower():
+            node = node.children.get(c)
+            if node is None:
+                return None
+        return node
+
+    def complete(self, prefix: str, limit: int = 8) -> list:
+        """ Returns up to limit words starting with prefix, most frequent first """
+        node = self.find(prefix)
+        if node is None:
+            return []
+
+        candidates = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.spellings:
+                word, _ = node.spellings.most_common(1)[0]
+                candidates.append((sum(node.spellings.values()), word))
+            stack.extend(node.children.values())
+
+        skip = prefix.lower()
+        best = heapq.nlargest(limit + 1, candidates)
+        return [word for _, word in best if word.lower() != skip][:limit]
+
+
+#============================================================================
+# vocabulary
+#============================================================================
+class Vocabulary():
+    """ Frequency ranked words of a document, maintained from edit deltas """
+    def __init__(self, min_length: int = 3) -> None:
+        self.min_length = min_length
+        self.words = PrefixTree()
+
+    def _count(self, text: str) -> Counter:
+        words = WORD_PATTERN.findall(text)
+        return Counter(w for w in words if len(w) >= self.min_length)
+
+    def apply(self, change) -> None:
+        """ Update the vocabulary from a TextChange """
+        old = self._count(change.old_text)
+        new = self._count(change.new_text)
+
+        # only touch words whose count actually changed
+        for word, count in (old - new).items():
+            self.words.remove(word, count)
+        for word, count in (new - old).items():
+            self.words.add(word, count)
+
+    def complete(self, prefix: str, limit: int = 8) -> list:
+        return self.words.complete(prefix, limit)
@@ -0,0 +1,151 @@
+import os, sys, struct, select, difflib, threading, ctypes, ctypes.util
+
+# inotify flags (see <sys/inotify.h>)
+IN_MODIFY       = 0x00000002
+IN_CLOSE_WRITE  = 0x00000008
+IN_MOVED_TO     = 0x00000080
+IN_CREATE       = 0x00000100
+IN_DELETE       = 0x00000200
+IN_NONBLOCK     = 0x00000800
+IN_CLOEXEC      = 0x00080000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')
+
+def load_inotify():
+    """ Returns libc if it provides inotify, else None """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+def stat_signature(filename: str) -> tuple:
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+#============================================================================
+# file watcher
+#============================================================================
+class FileWatcher():
+    """ Calls back on the Tk main loop when a file is changed by someone else.
+        Uses inotify on Linux and falls back to polling os.stat elsewhere. """
+    def __init__(self, widget, callback, interval: int = 500) -> None:
+        """
+        :param callback: called without arguments after the file changed
+        :param interval: milliseconds between checks on the main loop
+        """
+        self.widget = widget
+        self.callback = callback
+        self.interval = interval
+
+        self.filename = None
+        self.signature = None
+
+        self._libc = load_inotify()
+        self._thread = None
+        self._stop = threading.Event()
+        self._dirty = threading.Event()
+        self._job = None
+
+    def watch(self, filename: str) -> None:
+        """ Start watching filename, None stops watching """
+        self.stop()
+
+        self.filename = filename
+        if not filename:
+            return
+
+        self.sync()
+        if self._libc:
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run_inotify, args=(self._stop,), daemon=True)
+            self._thread.start()
+
+        self._job = self.widget.after(self.interval, self._check)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread = None
+        if self._job:
+            self.widget.after_cancel(self._job)
+            self._job = None
+
+    def sync(self) -> None:
+        """ Accept the current state of the file, e.g. after saving it ourselves """
+        self.signature = stat_signature(self.filename)
+        self._dirty.clear()
+
+    def _check(self) -> None:
+        self._job = self.widget.after(self.interval, self._check)
+
+        # with inotify only stat after an event was reported
+        if self._thread and not self._dirty.is_set():
+            return
+        self._dirty.clear()
+
+        signature = stat_signature(self.filename)
+        if signature and signature != self.signature:
+            self.signature = signature
+            self.callback()
+
+    def _run_inotify(self, stop: threading.Event) -> None:
+        # watch the directory, tools often replace files instead of writing them
+        folder, name = os.path.split(os.path.abspath(self.filename))
+        name = os.fsencode(name)
+
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            self._thread = None
+            return
+        try:
+            if self._libc.inotify_add_watch(fd, os.fsencode(folder), WATCH_MASK) < 0:
+                self._thread = None
+                return
+
+            while not stop.is_set():
+                ready, _, _ = select.select([fd], [], [], 1.0)
+                if not ready:
+                    continue
+
+                buffer = os.read(fd, 64 * 1024)
+                offset = 0
+                while offset < len(buffer):
+                    _, _, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+                    offset += EVENT_HEADER.size
+                    if buffer[offset:offset + length].rstrip(b'\0') == name:
+                        self._dirty.set()
+                    offset += length
+        finally:
+            os.close(fd)
+
+#============================================================================
+# line diff
+#============================================================================
+def split_lines(text: str) -> list:
+    """ Split text into lines like the text widget does (only at '\\n') """
+    lines = [line + '\n' for line in text.split('\n')]
+    lines[-1] = lines[-1][:-1]
+    return lines if lines[-1] else lines[:-1]
+
+def line_changes(old: str, new: str) -> list:
+    """ Returns the (first line, last line, new text) replacements that turn
+        old into new. Lines are 1 based and exclusive, the last change comes
+        first so the changes can be applied in order without shifting. """
+    old_lines = split_lines(old)
+    new_lines = split_lines(new)
+
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    changes = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != 'equal':
+            changes.append((i1 + 1, i2 + 1, ''.join(new_lines[j1:j2])))
+
+    changes.reverse()
+    return changes
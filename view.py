@@ -2,6 +2,8 @@ import tkinter as tk
 from tkinter import ttk
 
 from lib.extendedTk import *
+from lib.scheduler import Scheduler
+from lib.changes import ADDED, MODIFIED
 
 THEME_SETTINGS = """
 namespace eval ttk::theme::capricorn {
@@ -61,6 +63,10 @@ namespace eval ttk::theme::capricorn {
 class View(tk.Tk):
     def __init__(self) -> None:
         super().__init__()
+
+        # runs status updates and analysis in idle time
+        self.scheduler = Scheduler(self)
+
         # icon
         try:    self.iconbitmap('capricorn.ico')
         except: pass
@@ -83,6 +89,16 @@ class View(tk.Tk):
         self.text.bind('<Control-o>', lambda _: self.on_event('<<open>>'))
         self.text.bind('<Control-s>', lambda _: self.on_event('<<save>>'))
         self.text.bind('<Control-S>', lambda _: self.on_event('<<save-as>>'))
+        self.text.bind('<Control-F>', lambda _: self.on_event('<<show-search>>'))
+        self.bind('<Control-backslash>', lambda _: self.toggle_split())
+
+        # word completion
+        self.text.bind('<Control-space>', lambda _: self.on_event('<<complete>>'))
+        self.text.bind('<KeyRelease>', self.on_key_release)
+        self.text.bind('<Button-1>', lambda _: self.completion.hide())
+        self.text.bind('<FocusOut>', lambda _: self.completion.hide())
+        for key in ('<Up>', '<Down>', '<Return>', '<Tab>', '<Escape>'):
+            self.text.bind(key, self.on_completion_key)
 
     def load_config(self, config: dict) -> None:
         self.geometry(f"{config['width']}x{config['height']}")
@@ -102,11 +118,58 @@ class View(tk.Tk):
 
         # apply style for text widget
         self.text._apply_style("Text")
+        self.text.sync_peers()
+
+        self.gutter.configure(background=colors['bg_main'])
+        self.gutter.colors = {ADDED: colors['line_added'], MODIFIED: colors['line_modified']}
+        self.gutter.schedule()
+
+        self.completion.configure(
+            background=colors['bg_status'], foreground=colors['fg_main'],
+            selectbackground=colors['bg_main'], selectforeground=colors['fg_main'])
 
     def on_event(self, sequence: str):
         self.event_generate(sequence)
         return 'break'
 
+    def on_yscroll(self, scroll: AutoScrollbar, first: str, last: str) -> None:
+        scroll.set(first, last)
+        self.gutter.schedule()
+        self.event_generate('<<yview-changed>>')
+
+    def on_key_release(self, event: tk.Event) -> None:
+        if event.keysym == 'BackSpace' or event.char.isalnum() or event.char == '_':
+            self.event_generate('<<complete>>')
+        elif event.char or event.keysym in ('Left', 'Right', 'Home', 'End', 'Prior', 'Next'):
+            self.completion.hide()
+
+    def on_completion_key(self, event: tk.Event):
+        if not self.completion.visible():
+            return None
+
+        if event.keysym == 'Up':
+            self.completion.move(-1)
+        elif event.keysym == 'Down':
+            self.completion.move(1)
+        elif event.keysym in ('Return', 'Tab'):
+            self.accept_completion()
+        else:
+            self.completion.hide()
+        return 'break'
+
+    def show_completions(self, words: list) -> None:
+        self.completion.show(words)
+
+    def accept_completion(self) -> None:
+        word = self.completion.selected()
+        self.completion.hide()
+        if not word:
+            return
+
+        start = self.text.index('insert-1c wordstart')
+        self.text.delete(start, 'insert')
+        self.text.insert('insert', word)
+
     def create_menu(self) -> None:
         menu = ExtendedMenu(self)
 
@@ -116,6 +179,7 @@ class View(tk.Tk):
             ("Open File", "Ctrl+O",       lambda: self.on_event('<<open>>')),
             ("Save",      "Ctrl+S",       lambda: self.on_event('<<save>>')),
             ("Save As",   "Ctrl+Shift+S", lambda: self.on_event('<<save-as>>')),
+            ("Revisions", None,           lambda: self.on_event('<<show-revisions>>')),
             (),
             ("Settings",  None,           lambda: self.on_event('<<show-pref>>')),
             (),
@@ -133,10 +197,20 @@ class View(tk.Tk):
             #(),
             #("Find",    "Ctrl+F",   None),
             #("Replace", "Ctrl+H",   None),
+            (),
+            ("Find in Project", "Ctrl+Shift+F", lambda: self.on_event('<<show-search>>')),
+        ])
+
+        # view
+        menu.load_cascade("View", [
+            ("Split View", "Ctrl+\\",   self.toggle_split),
         ])
 
         # help
         menu.load_cascade("Help", [
+            ("Memory Diagnostics", None, lambda: self.on_event('<<show-diagnostics>>')),
+            ("Save Memory Report", None, lambda: self.on_event('<<dump-diagnostics>>')),
+            (),
             ("About", None, lambda: self.on_event('<<show-about>>'))
         ])
 
@@ -146,12 +220,23 @@ class View(tk.Tk):
         workspace = ttk.Frame(self)
         workspace.columnconfigure(0, weight=1)
         workspace.rowconfigure(0, weight=1)
+        self.workspace = workspace
+        self.peer = None
 
         # text frame
         frame = ttk.Frame(workspace)
+        inner = ttk.Frame(frame)
+
+        self.text = ExtendedText(inner, wrap=tk.WORD)
 
-        self.text = ExtendedText(frame, wrap=tk.WORD, undo=True)
-        self.text.pack(side=tk.TOP, fill=tk.Y, expand=True, pady=8)
+        # marks lines changed since the last save
+        self.gutter = ChangeGutter(inner, self.text)
+        self.gutter.pack(side=tk.LEFT, fill=tk.Y, padx=(0, 4))
+        self.text.pack(side=tk.LEFT, fill=tk.Y, expand=True)
+
+        inner.pack(side=tk.TOP, fill=tk.Y, expand=True, pady=8)
+
+        self.completion = CompletionPopup(self.text, borderwidth=1, relief=tk.SOLID)
 
         frame.grid(row=0, column=0, sticky=tk.NSEW)
 
@@ -161,13 +246,45 @@ class View(tk.Tk):
 
         # scroll commands
         scroll['command'] = lambda *args: self.text.yview(*args)
-        self.text['yscrollcommand'] = lambda first, last: scroll.set(first, last)
+        self.text['yscrollcommand'] = lambda first, last: self.on_yscroll(scroll, first, last)
 
         # focus on text widget
         self.text.focus_set()
 
         workspace.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
 
+    def toggle_split(self) -> None:
+        """ Show a second pane on the same text, using a Tk text peer so
+            both panes share one buffer and all tags """
+        if self.peer:
+            frame = self.peer.master
+            self.text.remove_peer(self.peer)
+            self.peer_scroll.destroy()
+            frame.destroy()
+            self.workspace.rowconfigure(1, weight=0)
+            self.peer = None
+            self.text.focus_set()
+            return
+
+        frame = ttk.Frame(self.workspace)
+        self.peer = self.text.create_peer(frame)
+        self.peer.pack(side=tk.TOP, fill=tk.Y, expand=True, pady=8)
+        frame.grid(row=1, column=0, sticky=tk.NSEW)
+        self.workspace.rowconfigure(1, weight=1)
+
+        scroll = AutoScrollbar(self.workspace, orient=tk.VERTICAL)
+        scroll.grid(row=1, column=1, sticky=tk.NS)
+        scroll['command'] = lambda *args: self.peer.yview(*args)
+        self.peer['yscrollcommand'] = lambda first, last: scroll.set(first, last)
+        self.peer_scroll = scroll
+
+        # same shortcuts as the main pane
+        for sequence in ('<Control-n>', '<Control-o>', '<Control-s>', '<Control-S>', '<Control-F>'):
+            self.peer.bind(sequence, self.text.bind(sequence))
+
+        self.peer.yview(self.text.index('@0,0'))
+        self.peer.focus_set()
+
     def create_statusbar(self) -> None:
         statusbar = ttk.Frame(self, style='Statusbar.TFrame')
         statusbar.columnconfigure(1, weight=1)
@@ -177,6 +294,9 @@ class View(tk.Tk):
 
         frame = ttk.Frame(statusbar, style='Statusbar.TFrame')
 
+        self.label_page_count = ttk.Label(frame, style='Statusbar.TLabel')
+        self.label_page_count.pack(side=tk.LEFT, padx=8)
+
         self.label_word_count = ttk.Label(frame, style='Statusbar.TLabel')
         self.label_word_count.pack(side=tk.LEFT, padx=8)
 
@@ -1,10 +1,27 @@
 
-import re, os
+import re, os, asyncio
+
+from concurrent.futures import ThreadPoolExecutor
 
 import tkinter as tk
 import tkinter.messagebox as mbox
 
 from view import View
+from lib.vocabulary import Vocabulary
+from lib.spellcheck import SpellChecker
+from lib.history import UndoManager
+from lib.revisions import RevisionStore
+from lib.watcher import FileWatcher, line_changes
+from lib.tokenizer import Tokenizer
+from lib.patterns import PatternWorker
+from lib.analysis import ParallelAnalyzer
+from lib.session import content_hash
+from lib.layout import LayoutEngine
+from lib.changes import ChangeTracker
+from lib.textfile import text_stream, open_text
+
+# characters read or written at once by the file workers
+IO_CHUNK = 1 << 20
 
 #============================================================================
 # workspace / model
@@ -13,12 +30,46 @@ class Workspace():
     def __init__(self, view: View) -> None:
         self.text = view.text
 
+        self.page_count = tk.StringVar(value="Pages: -")
         self.word_count = tk.StringVar(value="Wordcount: -")
         self.insert_pos = tk.StringVar(value="Ln -, Col -")
         
+        view.label_page_count['textvariable'] = self.page_count
         view.label_word_count['textvariable'] = self.word_count
         view.label_insert_pos['textvariable'] = self.insert_pos
 
+        self.vocabulary = Vocabulary()
+        self.text.add_change_listener(self.vocabulary.apply)
+
+        self.history = UndoManager(self.text)
+
+        # lines changed since the last save, shown in the gutter
+        self.changes = ChangeTracker(self.text)
+        view.gutter.source = self.changes.lines
+        self.tokenizer = Tokenizer(self.text)
+        self.layout = LayoutEngine(self.text)
+        self.tokenizer.add_token_listener(self.layout.on_tokens)
+
+        # user patterns are evaluated in a worker process
+        self.patterns = PatternWorker(self.on_pattern_disabled)
+        self.pattern_warning = ''
+        self.analyzer = ParallelAnalyzer(self.text)
+
+        self.dictionary = None
+        self.spellchecker = SpellChecker(self.text)
+
+        self.keep_revisions = True
+        self.revision_error = None
+        self.words = None
+        self.words_change_count = None
+        self.content_hash = None
+
+        # counts replacing the whole text by another document
+        self.document = 0
+
+        self.watcher = FileWatcher(self.text, self.on_file_changed)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
         self.saved = True
         self.set_filename(None)
 
@@ -27,68 +78,376 @@ class Workspace():
             'width': config['text_width'],
             'font': config['font']
         })
+        self.text.sync_peers()
+
+        self.keep_revisions = config['keep_revisions'] == '1'
+
+        # time a block of lines may take to highlight in milliseconds
+        self.patterns.budget = int(config['pattern_budget']) / 1000
+
+        # undo memory budget in megabytes
+        self.history.budget = int(config['undo_memory']) * 1024 * 1024
+
+        # only reload the word list if it changed
+        if config['dictionary'] != self.dictionary:
+            self.dictionary = config['dictionary']
+            self.spellchecker.load(self.dictionary)
 
     def set_filename(self, filename: str) -> None:
         self.path = os.path.abspath(filename) if filename else None
         self.filename = os.path.basename(filename) if filename else "untitled"
 
+        self.watcher.watch(self.path)
+
     def get_title(self) -> str:
         return self.filename if self.saved else '*' + self.filename
 
-    def tag_pattern(self, pattern: str, tag: str) -> None:
-        # remove tag
-        self.text.tag_remove(tag, "1.0", tk.END)
+    def load_patterns(self, patterns: dict, regions: dict) -> None:
+        """ Highlight single line patterns and multi-line regions,
+            a region is given as its start and end pattern on two lines """
+        regions = {tag: region.strip().split('\n', 1) for tag, region in regions.items()}
+        lexer = self.patterns.configure(patterns, regions)
+        if lexer is not self.tokenizer.lexer:
+            self.tokenizer.set_lexer(lexer, self.patterns)
+
+    def on_pattern_disabled(self, tag: str, reason: str) -> None:
+        if tag:
+            self.pattern_warning = f"Disabled pattern '{tag}': {reason}"
+        else:
+            self.pattern_warning = f"Highlighting runs without protection, {reason}"
+        self.text.event_generate('<<pattern-disabled>>')
+
+    def load_layout(self, config: dict, tags: dict) -> None:
+        """ Set page geometry and fonts used to estimate the page count,
+            the pages are counted by update_page_count """
+        self.layout.configure(config, tags)
+
+    def update_page_count(self):
+        """ Generator that lays out the dirty paragraphs block by block """
+        yield from self.layout.steps()
+        self.page_count.set(f"Pages: {self.layout.pages}")
+
+    def update_highlighting(self):
+        """ Generator that highlights the dirty lines block by block """
+        return self.tokenizer.steps()
+
+    def analyze(self, callback) -> bool:
+        """ Start the first analysis of a large text on all cores. callback is
+            called with True if the result was applied. Returns False if the
+            text is analyzed on the main loop as usual """
+        expressions = self.patterns.expressions()
+        change_count = self.text.change_count
+        return self.analyzer.start(self.text.get('1.0', 'end-1c'), *expressions, self.patterns.budget,
+            lambda result: self._apply_analysis(result, expressions, change_count, callback))
+
+    def _apply_analysis(self, result, expressions: tuple, change_count: int, callback) -> None:
+        # drop the result if the text or the patterns changed in the meantime
+        applied = result is not None and change_count == self.text.change_count \
+            and expressions == self.patterns.expressions() \
+            and self.tokenizer.load(result.states, result.tokens, result.speculative)
+
+        if applied:
+            self.set_word_count(result.words)
+        callback(applied)
+
+    def get_completions(self) -> list:
+        """ Returns completions for the word in front of the insert cursor """
+        prefix = self.text.get('insert-1c wordstart', 'insert')
+        if len(prefix) < self.vocabulary.min_length or not re.fullmatch('\w+', prefix):
+            return []
+        return self.vocabulary.complete(prefix)
 
-        # find and highlight all matches
-        lines = self.text.get("1.0", tk.END).splitlines()
-        for i, line in enumerate(lines):
-            for match in re.finditer(pattern, line):
-                index1 = f"{i + 1}.{match.start()}"
-                index2 = f"{i + 1}.{match.end()}"
-                self.text.tag_add(tag, index1, index2)
+    def get_revisions(self) -> list:
+        return RevisionStore(self.path).revisions() if self.path else []
 
-    def update_insert_pos(self) -> None:
-        ln, col = self.text.index('insert').split('.')
+    def diff_revision(self, revision: dict) -> list:
+        return RevisionStore(self.path).diff(revision, self.text.get('1.0', 'end-1c'), self.filename)
+
+    def restore_revision(self, revision: dict) -> None:
+        """ Replace the text with a revision, the undo history is cleared """
+        text = RevisionStore(self.path).read(revision)
+
+        with self.history.paused():
+            self.text.delete('1.0', tk.END)
+            self.text.insert('1.0', text)
+
+    def on_file_changed(self) -> None:
+        """ Merge changes another program made to the file into the text """
+        if not self.saved:
+            prompt = f"{self.filename} was changed by another program.\n" \
+                      "Do you want to reload it and lose your changes?"
+            if not mbox.askyesno(title="File Changed", message=prompt, default=mbox.NO):
+                return
+
+        # diff in the background against a snapshot of the text
+        text = self.text.get('1.0', 'end-1c')
+        future = self._executor.submit(self._diff_file, self.path, text)
+        self.text.after(20, self._apply_file_changes, future, self.text.change_count)
+
+    def _diff_file(self, filename: str, text: str) -> list:
+        with open_text(filename, 'r') as f:
+            return line_changes(text, f.read())
+
+    def _apply_file_changes(self, future, change_count: int) -> None:
+        if not future.done():
+            self.text.after(20, self._apply_file_changes, future, change_count)
+            return
+
+        # the text was edited while diffing, start over
+        if change_count != self.text.change_count:
+            return self.on_file_changed()
+
+        try:
+            changes = future.result()
+        except Exception as e:
+            mbox.showerror(type(e).__name__, f"Could not reload {self.filename}:\n{e}")
+            return
+
+        # keep the first visible line in place
+        self.text.mark_set('reload_top', '@0,0')
+        self.text.mark_gravity('reload_top', tk.LEFT)
+
+        ops = []
+        for first, last, text in changes:
+            ops.append(('delete', first, 0, last, 0))
+            ops.append(('insert', first, 0, text))
+
+        with self.history.paused():
+            self.text.edit_batch(ops)
+
+        self.text.yview('reload_top')
+        self.text.mark_unset('reload_top')
+
+        self.changes.reset(self.text.get('1.0', 'end-1c'))
+        self.saved = True
+        self.text.event_generate('<<file-reloaded>>')
+
+    def goto(self, line: int, query: str = '', lines: int = 1) -> None:
+        """ Move the cursor to the first word of query within lines lines
+            from line on, or to the start of line """
+        index = f'{line}.0'
+        words = query.replace('"', ' ').replace('*', ' ').split()
+        if words:
+            found = self.text.search(words[0], index, stopindex=f'{line + lines}.0', nocase=True)
+            index = found or index
+
+        self.text.mark_set('insert', index)
+        self.text.see('insert')
+        self.text.focus_set()
+
+    def update_spelling(self) -> None:
+        self.spellchecker.schedule()
+
+    def update_insert_pos(self, text: tk.Text = None) -> None:
+        """ Show the cursor of text, which may be a peer of the main text """
+        ln, col = (text or self.text).index('insert').split('.')
         self.insert_pos.set(f"Ln {ln}, Col {col}")
 
-    def update_word_count(self) -> None:
-        count = len(re.findall('\w+', self.text.get('1.0', 'end-1c')))
+    def update_word_count(self, block: int = 2000):
+        """ Generator that counts the words block by block of lines """
+        count = 0
+        change_count = self.text.change_count
+        lines = int(self.text.index('end-1c').split('.')[0])
+        for line in range(1, lines + 1, block):
+            count += len(re.findall('\w+', self.text.get(f'{line}.0', f'{line + block}.0')))
+            yield
+
+        self.set_word_count(count, change_count)
+
+    def set_word_count(self, count: int, change_count: int = None) -> None:
+        """ Show the word count of the text as of change_count, by default
+            the current text """
+        self.words = count
+        self.words_change_count = self.text.change_count if change_count is None else change_count
         self.word_count.set(f"Wordcount: {count}")
 
+    def get_state(self, patterns_key: str) -> dict:
+        """ Returns the view state and analysis results of the text """
+        return {
+            'hash': content_hash(self.text.get('1.0', 'end-1c')),
+            'patterns': patterns_key,
+            'cursor': self.text.index('insert'),
+            'yview': self.text.yview()[0],
+            # the count is outdated while a recount is pending
+            'words': self.words if self.words_change_count == self.text.change_count else None,
+            'tokens': self.tokenizer.export()
+        }
+
+    def restore_state(self, state: dict, patterns_key: str) -> bool:
+        """ Restore a state of get_state. The cached analysis is only used
+            if neither the text nor the patterns changed, returns if it was """
+        self.text.mark_set('insert', state['cursor'])
+        self.text.after_idle(self.text.yview_moveto, state['yview'])
+
+        if state['hash'] != self.content_hash or state['patterns'] != patterns_key:
+            return False
+        if state['words'] is None or state['tokens'] is None:
+            return False
+        if not self.tokenizer.restore(state['tokens']):
+            return False
+
+        self.set_word_count(state['words'])
+        return True
+
+    def register_diagnostics(self, diagnostics) -> None:
+        """ Report the sizes of the caches of the workspace """
+        diagnostics.register('undo', self.history.stats)
+        diagnostics.register('vocabulary', lambda: {'words': self.vocabulary.words.root.count})
+        diagnostics.register('dictionary', lambda: {
+            'words': len(self.spellchecker.words) if self.spellchecker.words else 0,
+            'bytes': self.spellchecker.words.memory() if self.spellchecker.words else 0,
+            'checked_lines': len(self.spellchecker.checked) - self.spellchecker.checked.count(0),
+        })
+        diagnostics.register('tokenizer', lambda: {
+            'states': len(self.tokenizer.states),
+            'dirty': self.tokenizer.dirty.count(1),
+        })
+        diagnostics.register('layout', lambda: {
+            'paragraphs': len(self.layout.paragraphs),
+            'fonts': len(self.layout.fonts),
+            'word_widths': sum(len(f.widths) for f in self.layout.fonts.values()),
+        })
+        diagnostics.register('changes', lambda: {
+            'saved_lines': len(self.changes.baseline),
+            **self.changes.counts(),
+        })
+        diagnostics.register('patterns', lambda: {
+            'worker': self.patterns.running(),
+            'disabled': len(self.patterns.disabled),
+        })
+
+    def close(self) -> None:
+        self.watcher.stop()
+        self.patterns.close()
+        self.analyzer.close()
+
     def new_file(self) -> None:
-        self.text.delete('1.0', tk.END)
         # prevent undoing clearing the text
-        self.text.edit_reset()
+        with self.history.paused():
+            self.text.delete('1.0', tk.END)
+        self.changes.reset('')
 
         self.saved = True
         self.set_filename(None)
 
     def read_file(self, filename: str) -> bool:
         try:
-            with open(filename, 'r') as f:
-                text = f.read()
-                # clear text
-                self.text.delete('1.0', tk.END)
-                # insert new text
-                self.text.insert('1.0', text)
-                # prevent undoing reading the file
-                self.text.edit_reset()
+            text = self._read(filename)
         except Exception as e:
             mbox.showerror(type(e).__name__, f"Could not open {filename}:\n{e}")
             return False
 
-        self.saved = True
-        self.set_filename(filename)
+        self._load_text(filename, text)
+        return True
+
+    async def read_file_async(self, filename: str, progress=None) -> bool:
+        """ Read the file in a worker thread, progress is called with
+            (done, total) on the main loop """
+        try:
+            text = await asyncio.to_thread(self._read, filename, self._progress(progress))
+        except Exception as e:
+            mbox.showerror(type(e).__name__, f"Could not open {filename}:\n{e}")
+            return False
+
+        self._load_text(filename, text)
         return True
 
     def write_file(self, filename: str) -> bool:
+        text = self.text.get('1.0', 'end-1c')
         try:
-            with open(filename, 'w') as f:
-                f.write(self.text.get('1.0', 'end-1c'))
+            self._write(filename, text)
         except Exception as e:
             mbox.showerror("Error", f"Could not save {filename}:\n{e}")
             return False
 
+        self.revision_error = self._store_revision(filename, text)
+        self.changes.reset(text)
+        self._saved_as(filename)
+        return True
+
+    async def write_file_async(self, filename: str, progress=None) -> bool:
+        """ Write the file in a worker thread, edits made meanwhile
+            leave the text unsaved """
+        text = self.text.get('1.0', 'end-1c')
+        change_count = self.text.change_count
+        document = self.document
+
+        # do not report our own save as an external change
+        self.watcher.stop()
+        try:
+            await asyncio.to_thread(self._write, filename, text, self._progress(progress))
+        except Exception as e:
+            mbox.showerror("Error", f"Could not save {filename}:\n{e}")
+            return False
+        finally:
+            self.watcher.watch(self.path)
+
+        self.revision_error = await asyncio.to_thread(self._store_revision, filename, text)
+
+        # another document was opened meanwhile, it is not the saved file
+        if document != self.document:
+            return True
+
+        saved = change_count == self.text.change_count
+        self.changes.reset(text, None if saved else self.text.get('1.0', 'end-1c'))
+        self._saved_as(filename, saved)
+        return True
+
+    def _progress(self, progress):
+        """ Wrap a progress callback so worker threads can call it """
+        if progress is None:
+            return None
+        loop = asyncio.get_running_loop()
+        return lambda done, total: loop.call_soon_threadsafe(progress, done, total)
+
+    def _read(self, filename: str, progress=None) -> str:
+        """ Read in chunks, compressed files are decompressed while
+            streaming. Safe to call from any thread """
+        total = os.path.getsize(filename)
+        chunks = []
+        with open(filename, 'rb') as raw, text_stream(raw, filename, 'r') as f:
+            while chunk := f.read(IO_CHUNK):
+                chunks.append(chunk)
+                if progress:
+                    progress(min(raw.tell(), total), total)
+        return ''.join(chunks)
+
+    def _write(self, filename: str, text: str, progress=None) -> None:
+        """ Write in chunks, the extension of filename selects the
+            compression. Safe to call from any thread """
+        total = len(text)
+        with open(filename, 'wb') as raw, text_stream(raw, filename, 'w') as f:
+            for i in range(0, total, IO_CHUNK):
+                f.write(text[i:i + IO_CHUNK])
+                if progress:
+                    progress(min(i + IO_CHUNK, total), total)
+
+    def _store_revision(self, filename: str, text: str) -> str:
+        """ Returns why the snapshot could not be stored or None """
+        if not self.keep_revisions:
+            return None
+        try:
+            RevisionStore(filename).commit(text)
+        except OSError as e:
+            # the file itself was saved, losing a snapshot is not fatal
+            return f"could not store a revision: {e}"
+        return None
+
+    def _load_text(self, filename: str, text: str) -> None:
+        # prevent undoing reading the file
+        with self.history.paused():
+            self.text.delete('1.0', tk.END)
+            self.text.insert('1.0', text)
+        self.content_hash = content_hash(text)
+        self.changes.reset(text)
+
         self.saved = True
+        self.document += 1
+        self.set_filename(filename)
+
+    def _saved_as(self, filename: str, saved: bool = True) -> None:
+        # do not report our own save as an external change
+        self.watcher.sync()
+
+        self.saved = saved
         self.set_filename(filename)
-        return True
\ No newline at end of file